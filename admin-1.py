@@ -1,20 +1,21 @@
+import os
+from datetime import datetime, timezone
 import streamlit as st
-from supabase import create_client, Client
+import startup
+import metrics
+import events
 
 # ===============================
 # --- 1. 初期設定 ---
 # ===============================
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_SERVICE_ROLE_KEY = st.secrets["SUPABASE_SERVICE_ROLE_KEY"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
-ADMIN_ID = st.secrets["ADMIN_ID"]
-ADMIN_PASSWORD = st.secrets["ADMIN_PASSWORD"]
+metrics.start_rerun("admin")
 
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
 if "edit_order" not in st.session_state:
     st.session_state.edit_order = None
+if "event" not in st.session_state:
+    st.session_state.event = None
 
 # ===============================
 # --- 2. ログイン画面 ---
@@ -25,122 +26,287 @@ if not st.session_state.logged_in:
     pass_input = st.text_input("パスワード", type="password")
     
     if st.button("ログイン"):
-        if user_input == ADMIN_ID and pass_input == ADMIN_PASSWORD:
+        # イベント（学校）ごとのログイン情報で認証する。st.secrets の初回の読み込みは遅いので、
+        # ログイン画面の表示には使わずボタンを押した時に読む
+        event = events.authenticate("admin", user_input, pass_input)
+        if event is not None:
+            st.session_state.event = event
             st.session_state.logged_in = True
             # ログイン成功メッセージは出さずに画面遷移
             st.session_state.edit_order = None
         else:
             st.error("ユーザーIDまたはパスワードが違います")
+    # ログイン画面は streamlit だけで表示する。supabase・pandas などを使うモジュールの
+    # 読み込みとクライアントの作成は、画面を描いた後に別スレッドで進めておく
+    startup.warm_up("admin", role="service")
+    metrics.finish_rerun()
     st.stop()
 
+# ===============================
+# --- 初期設定（ログイン後） ---
+# ===============================
+# ここから先で使うモジュールはログイン後に読み込む（通常は warm_up で読み込み済み）
+import async_repo  # noqa: E402
+from db import get_async_client, get_catalog, get_client, get_event_loop, get_order_cache, get_write_queue  # noqa: E402
+from order_browser import QUEUE_COLUMNS, OrderSnapshot  # noqa: E402
+from measurement_session import ConflictError, MeasurementSession  # noqa: E402
+from orders_repo import get_order, measurement_sheet, prefetch_orders  # noqa: E402
+from order_search import OrderSearch  # noqa: E402
+
+event = st.session_state.event
+# クライアントはサーバープロセス内で共有され、再実行のたびには作り直さない。
+# 読み書きはログインしたイベントの注文だけに絞る
+supabase = events.EventScope(get_client("service"), event.id)
+# 互いに依存しないクエリは非同期クライアントで同時に送る（async_repo.py）
+async_supabase = events.EventScope(get_async_client("service"), event.id)
+loop = get_event_loop()
+order_cache = get_order_cache(event.id)
+# 採寸の保存はローカルのジャーナルに記録し、バックグラウンドで Supabase に送る（イベントごと）
+writes = get_write_queue("service", event.id)
+
+# 一覧・検索・採寸待ちの列はイベントごとに持ち、他のイベントの更新で取り直さない
+@st.cache_resource
+def get_order_snapshot(event_id, status):
+    # イベント・ステータスごとに1つ、サーバープロセス内で共有する
+    return OrderSnapshot(events.EventScope(get_client("service"), event_id), status=status)
+
+@st.cache_resource
+def get_order_search(event_id):
+    # 最近の検索結果はイベントごとにサーバープロセス内で共有する
+    return OrderSearch(events.EventScope(get_client("service"), event_id))
+
+@st.cache_resource
+def get_waiting_queue(event_id):
+    # 採寸待ちの列。差分だけを取り直すので、短い間隔で更新しても全件は読まない
+    return OrderSnapshot(
+        events.EventScope(get_client("service"), event_id),
+        status="waiting", columns=QUEUE_COLUMNS, min_refresh=2.0,
+    )
+
 # ===============================
 # --- 3. メインメニュー ---
 # ===============================
-mode = st.sidebar.radio("機能を選択", ["採寸入力", "注文一覧"])
+mode = st.sidebar.radio("機能を選択", ["採寸入力", "注文一覧", "生産集計", "データ出力"])
+metrics.set_phase(mode)
+st.sidebar.caption(f"イベント: {event.name or event.code}")
 if st.sidebar.button("ログアウト"):
     st.session_state.logged_in = False
     st.session_state.edit_order = None
-    st.experimental_rerun()
+    st.session_state.event = None
+    st.rerun()
+
+cache_stats = order_cache.stats()
+st.sidebar.caption(
+    f"注文キャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']}"
+    f"（ヒット率 {cache_stats['hit_rate']:.0%}、{cache_stats['size']} 件）"
+)
+sync = writes.stats()
+if sync["pending"]:
+    st.sidebar.warning(f"⏳ 送信待ち {sync['pending']} 件（最も古いもの {sync['oldest_age']:.0f} 秒前）")
+if sync["conflict"] or sync["failed"]:
+    st.sidebar.error(f"反映できなかった保存 {sync['conflict'] + sync['failed']} 件")
 
 # ===============================
 # --- 4. 商品仕様 ---
 # ===============================
-product_specs = {
-    "blazer":       {"label": "ブレザー", "type": "qty_size_memo", "size_options": ["S","M","L","XL"], "types": ["Aタイプ", "Bタイプ"]},
-    "shirt":        {"label": "シャツ", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-    "pants":        {"label": "スラックス", "type": "pants", "waist_range": (61, 111, 3), "length_placeholder": "72"},
-    "vest":         {"label": "ベスト", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-    "sweater":      {"label": "セーター", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-    "sandals":      {"label": "サンダル", "type": "qty_size_memo", "size_options": {"range": (22, 31, 0.5)}},
-    "pe_shirt":     {"label": "体操服（上）", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-    "pe_halfpants": {"label": "ハーフパンツ", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-    "pe_jacket":    {"label": "ジャージ（上）", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-    "pe_pants":     {"label": "ジャージ（下）", "type": "qty_size_memo", "size_options": ["S","M","L","XL"]},
-}
+# 商品マスタは catalog.py で共通管理（選択肢はプロセス内で組み立て済み）
+catalog = get_catalog(event.id)
+# 採寸シートで読み書きする列
+SHEET_COLUMNS = measurement_sheet(catalog)
+# 採寸待ちの列に表示する人数と、採寸シートを先読みしておく人数
+QUEUE_SIZE = 10
+PREFETCH_COUNT = 3
+# 採寸シートの入力欄のキー（接頭辞 + 商品キー）
+SHEET_WIDGET_PREFIXES = ("t_", "w_", "l_", "m_p_", "s_", "m_s_")
 
 # ===============================
 # --- 5. 採寸入力モード ---
 # ===============================
 if mode == "採寸入力":
     st.title("採寸入力")
-    order_id_input = st.number_input("受付番号を入力", min_value=1, step=1, key="search_input_field")
 
-    if st.button("検索"):
-        res = supabase.table("orders").select("*").eq("id", order_id_input).execute()
-        if res.data and len(res.data) > 0:
-            st.session_state.edit_order = res.data[0]
+    def open_sheet(order_id, fresh=False):
+        """採寸シートを開く。fresh=False ならキャッシュ（先読み分）を使う"""
+        found = get_order(supabase, order_cache, order_id, columns=SHEET_COLUMNS, fresh=fresh, writes=writes)
+        if found:
+            # 前に開いた注文の入力値が残らないよう、入力欄をこの注文の値で作り直させる
+            for product in catalog.measured:
+                for prefix in SHEET_WIDGET_PREFIXES:
+                    st.session_state.pop(f"{prefix}{product.key}", None)
+            st.session_state.edit_order = MeasurementSession(supabase, found, cache=order_cache, writes=writes)
         else:
-            st.error(f"受付番号 {order_id_input} は登録されていません。")
+            st.error(f"受付番号 {order_id} は登録されていません。")
             st.session_state.edit_order = None
+        return found is not None
+
+    @st.fragment(run_every=5)
+    @metrics.fragment("waiting_queue")
+    def waiting_queue():
+        snapshot = get_waiting_queue(event.id)
+        current = st.session_state.edit_order
+        current_id = current.order["id"] if current else None
+
+        def upcoming(rows):
+            # 次に呼ぶお客様（開いている採寸シートは除く）
+            return [row["id"] for row in rows if row["id"] != current_id][:PREFETCH_COUNT]
+
+        # 前回の待ち列で次に呼ぶお客様の採寸シートを先読みしながら待ち列を更新する
+        # （待ち時間は2つのクエリの合計ではなく、遅い方だけになる）
+        prefetch = loop.submit(async_repo.prefetch_orders(
+            async_supabase, order_cache, upcoming(snapshot.oldest(refresh=False)), columns=SHEET_COLUMNS,
+        ))
+        queue = snapshot.oldest()
+        prefetch.result()
+
+        st.markdown(f"#### 採寸待ち（{len(queue)} 名）")
+        if not queue:
+            st.caption("採寸待ちのお客様はいません。")
+            return
+
+        now = datetime.now(timezone.utc)
+        for row in queue[:QUEUE_SIZE]:
+            waited = now - datetime.fromisoformat(row.get("waiting_since") or row["updated_at"])
+            c1, c2, c3 = st.columns([2, 4, 2])
+            c1.write(f"No. {row['id']}")
+            c2.write(f"{row['name']} 様（{int(waited.total_seconds() // 60)} 分待ち）")
+            # 先読み済みならDBに問い合わせずに開ける（保存時は version で競合を検出する）
+            if c3.button("開く", key=f"queue_open_{row['id']}", disabled=row["id"] == current_id):
+                if open_sheet(row["id"]):
+                    st.rerun()
+
+        # 待ち列の更新で新しく先頭に来たお客様の分（通常は先読み済みで問い合わせない）
+        prefetch_orders(supabase, order_cache, upcoming(queue), columns=SHEET_COLUMNS)
+
+    with st.container(border=True):
+        waiting_queue()
+
+    @st.fragment
+    @metrics.fragment("customer_search")
+    def customer_search():
+        # 入力が確定した時（Enter・フォーカス移動）だけ、この部分だけが再実行される
+        text = st.text_input(
+            "お客様を探す", key="customer_search",
+            placeholder="名前・電話番号・メールアドレス・郵便番号",
+        )
+        if not text.strip():
+            return
+        results = get_order_search(event.id).search(text)
+        if not results:
+            st.caption("該当するお客様はいません（名前は2文字以上、番号は3桁以上で検索します）。")
+        for row in results:
+            c1, c2, c3 = st.columns([2, 6, 2])
+            c1.write(f"No. {row['id']}")
+            c2.write(f"{row['name']} 様　{row.get('phone') or ''}　〒{row.get('zipcode') or ''}")
+            if c3.button("開く", key=f"search_open_{row['id']}"):
+                if open_sheet(row["id"], fresh=True):
+                    st.rerun()
+
+    customer_search()
+
+    order_id_input = st.number_input("受付番号を入力", min_value=1, step=1, key="search_input_field")
+
+    if st.button("検索"):
+        # 検索は明示的な操作なので常にDBから最新の内容を読み直す
+        open_sheet(order_id_input, fresh=True)
 
     if st.session_state.edit_order:
-        order = st.session_state.edit_order
+        session = st.session_state.edit_order
+        order = session.order
         st.subheader(f"注文者: {order.get('name')} 様")
+        try:
+            # 前回の保存が送信後に競合していないか
+            session.check()
+        except ConflictError as e:
+            st.error(f"{e} 再度検索して最新の内容を読み込んでください。")
         items = order.get("items") or {}
 
-        # 商品ごとの入力ループ
-        for key, spec in product_specs.items():
+        def sheet_changed(field, widget_key, card_key):
+            # 入力した商品のカードと保存ボタンだけを再実行する（他の商品のカードは描き直さない）
+            session.set(field, st.session_state[widget_key])
+            st.rerun([card_key, "sheet_actions"])
+
+        def measurement_card(product, qty):
+            key = product.key
+            card_key = f"card_{key}"
+            display_name = product.sheet_label
+            with st.container(border=True):
+                st.markdown(f"### 👕 {display_name}（数量：{qty}）")
+                item_data = {}
+
+                def changed(field, widget_key):
+                    return {"on_change": sheet_changed, "args": (field, widget_key, card_key)}
+
+                if product.types:
+                    t_idx = product.option_index("type", order.get(f"{key}_type"))
+                    item_data[f"{key}_type"] = st.selectbox("タイプ", product.types, index=t_idx, key=f"t_{key}", **changed(f"{key}_type", f"t_{key}"))
+
+                if product.kind == "pants":
+                    w_idx = product.option_index("waist", order.get(f"{key}_waist"))
+                    item_data[f"{key}_waist"] = st.selectbox("ウエスト(cm)", product.waist_options, index=w_idx, key=f"w_{key}", **changed(f"{key}_waist", f"w_{key}"))
+                    item_data[f"{key}_length"] = st.text_input("丈(cm)", value=order.get(f"{key}_length") or "", placeholder=product.length_placeholder, key=f"l_{key}", **changed(f"{key}_length", f"l_{key}"))
+                    item_data[f"{key}_memo"] = st.text_input("備考", value=order.get(f"{key}_memo") or "", key=f"m_p_{key}", **changed(f"{key}_memo", f"m_p_{key}"))
+
+                elif product.kind == "qty_size_memo":
+                    s_idx = product.option_index("size", order.get(f"{key}_size"))
+                    item_data[f"{key}_size"] = st.selectbox("サイズ", product.size_options, index=s_idx, key=f"s_{key}", **changed(f"{key}_size", f"s_{key}"))
+                    item_data[f"{key}_memo"] = st.text_input("備考", value=order.get(f"{key}_memo") or "", key=f"m_s_{key}", **changed(f"{key}_memo", f"m_s_{key}"))
+
+                # 変更された項目は sheet_changed が記録する。ここでは表示した値（初期値を含む）だけを覚える
+                session.show(item_data)
+
+        # 商品ごとの入力ループ（カードごとに独立して再実行される）
+        for product in catalog.measured:
             try:
-                qty = int(items.get(key, 0))
+                qty = int(items.get(product.key, 0))
             except ValueError:
                 qty = 0
             if qty <= 0:
                 continue
+            card_key = f"card_{product.key}"
+            st.fragment(metrics.fragment(card_key)(measurement_card), key=card_key)(product, qty)
 
-            display_name = spec.get("label", key)
-            with st.container(border=True):
-                st.markdown(f"### 👕 {display_name}（数量：{qty}）")
-                item_data = {}
+        st.divider()
 
-                if "types" in spec:
-                    type_options = spec["types"]
-                    current_type = order.get(f"{key}_type")
-                    t_idx = type_options.index(current_type) if current_type in type_options else 0
-                    item_data[f"{key}_type"] = st.selectbox("タイプ", type_options, index=t_idx, key=f"t_{key}")
-
-                if spec["type"] == "pants":
-                    w_start, w_end, w_step = spec["waist_range"]
-                    waist_options = list(range(w_start, w_end, w_step))
-                    db_waist = order.get(f"{key}_waist")
-                    try: db_waist_val = int(float(db_waist))
-                    except: db_waist_val = waist_options[0]
-                    w_idx = waist_options.index(db_waist_val) if db_waist_val in waist_options else 0
-                    item_data[f"{key}_waist"] = st.selectbox("ウエスト(cm)", waist_options, index=w_idx, key=f"w_{key}")
-                    item_data[f"{key}_length"] = st.text_input("丈(cm)", value=order.get(f"{key}_length") or "", key=f"l_{key}")
-                    item_data[f"{key}_memo"] = st.text_input("備考", value=order.get(f"{key}_memo") or "", key=f"m_p_{key}")
-                
-                elif spec["type"] == "qty_size_memo":
-                    s_opt = spec.get("size_options")
-                    if isinstance(s_opt, dict) and "range" in s_opt:
-                        start, end, step = s_opt["range"]
-                        size_choices = []
-                        curr = float(start)
-                        while curr <= end:
-                            size_choices.append(curr if step % 1 != 0 else int(curr))
-                            curr += step
-                    else:
-                        size_choices = s_opt
-                    
-                    current_size = order.get(f"{key}_size")
-                    try: s_idx = size_choices.index(current_size)
-                    except: s_idx = 0
-                    item_data[f"{key}_size"] = st.selectbox("サイズ", size_choices, index=s_idx, key=f"s_{key}")
-                    item_data[f"{key}_memo"] = st.text_input("備考", value=order.get(f"{key}_memo") or "", key=f"m_s_{key}")
-
-                # 一時保存
-                if st.button(f"{display_name} を一時保存", key=f"btn_{key}"):
+        @st.fragment(key="sheet_actions")
+        @metrics.fragment("sheet_actions")
+        def sheet_actions():
+            autosave = st.toggle("自動保存", key="autosave")
+            if autosave:
+                # 入力が止まってから数秒後に、変更分だけをまとめて保存する
+                @st.fragment(run_every=3)
+                @metrics.fragment("autosave_measurements")
+                def autosave_measurements():
                     try:
-                        supabase.table("orders").update(item_data).eq("id", order["id"]).execute()
-                        st.success(f"{display_name} の採寸データが更新されました ✅")
-                    except Exception as e:
-                        st.error(f"{display_name} の保存に失敗しました: {e}")
+                        if session.autosave():
+                            st.toast("採寸データを自動保存しました")
+                    except ConflictError as e:
+                        st.error(str(e))
+
+                autosave_measurements()
+
+            if session.syncing:
+                st.caption("⏳ 保存内容を送信中です（回線が切れていても端末に保存済みです）")
+
+            # 一時保存・確定ともに、全商品の変更分を1回の更新で送る
+            if st.button("一時保存", disabled=not session.dirty):
+                try:
+                    session.flush()
+                    st.success("採寸データが更新されました ✅")
+                except ConflictError as e:
+                    st.error(f"{e} 再度検索して最新の内容を読み込んでください。")
+                except Exception as e:
+                    st.error(f"保存に失敗しました: {e}")
+
+        sheet_actions()
 
-        st.divider()
-        # 確定ボタンはループ外
         if st.button("全ての採寸を完了して確定する", type="primary"):
-            supabase.table("orders").update({"status": "measured"}).eq("id", order["id"]).execute()
-            st.session_state.edit_order = None
-            st.success("全ての採寸が完了しました！")
+            try:
+                # 触らなかった選択欄の初期値も、表示どおりの採寸値として確定時に保存する
+                session.flush({**session.defaults(), "status": "measured"})
+                st.session_state.edit_order = None
+                st.success("全ての採寸が完了しました！")
+            except ConflictError as e:
+                st.error(f"{e} 再度検索して最新の内容を読み込んでください。")
 
 # ===============================
 # --- 6. 注文一覧モード ---
@@ -148,10 +314,93 @@ if mode == "採寸入力":
 elif mode == "注文一覧":
     st.title("注文一覧")
 
-    res = supabase.table("orders").select("id", "name", "status").order("id", desc=False).execute()
-    orders = res.data or []
+    status_labels = {"すべて": None, "採寸待ち": "waiting", "採寸済み": "measured", "注文確定": "completed"}
+    c1, c2 = st.columns(2)
+    status_label = c1.selectbox("ステータス", list(status_labels), key="list_status")
+    page_size = c2.selectbox("表示件数", [50, 100, 200], key="list_page_size")
+
+    # 絞り込み条件が変わったら1ページ目に戻す（各ページの開始位置を id で持つ）
+    list_key = (status_label, page_size)
+    if st.session_state.get("list_key") != list_key:
+        st.session_state.list_key = list_key
+        st.session_state.list_cursors = [0]
+
+    snapshot = get_order_snapshot(event.id, status_labels[status_label])
+    cursors = st.session_state.list_cursors
+    orders = snapshot.page(after_id=cursors[-1], limit=page_size)
 
     if not orders:
         st.info("注文データがありません。")
     else:
-        st.dataframe(orders, hide_index=True, use_container_width=True)
+        st.caption(f"{len(snapshot)} 件中 {len(cursors)} ページ目")
+        st.dataframe(
+            [{k: row[k] for k in ("id", "name", "status")} for row in orders],
+            hide_index=True, use_container_width=True,
+        )
+
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("前へ", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if next_col.button("次へ", disabled=len(orders) < page_size):
+        cursors.append(orders[-1]["id"])
+        st.rerun()
+
+# ===============================
+# --- 7. 生産集計モード ---
+# ===============================
+elif mode == "生産集計":
+    st.title("生産集計（採寸済み・注文確定）")
+    # pandas を使う集計・出力は、そのモードを開いた時に読み込む
+    from summary import ProductionSummary
+
+    @st.cache_resource
+    def get_production_summary(event_id, catalog_version):
+        # イベント・商品マスタの版ごとに1つ、サーバープロセス内で共有する
+        return ProductionSummary(events.EventScope(get_client("service"), event_id), catalog)
+
+    summary = get_production_summary(event.id, catalog.version)
+    if st.button("最新の状態に更新"):
+        summary.refresh(force=True)
+    table = summary.table()
+
+    if table.empty:
+        st.info("集計対象の注文がありません。")
+    else:
+        totals = table.groupby("商品", sort=False)["数量"].sum()
+        st.dataframe(totals.reset_index(), hide_index=True, use_container_width=True)
+        st.subheader("サイズ・タイプ別")
+        st.dataframe(table, hide_index=True, use_container_width=True)
+
+# ===============================
+# --- 8. データ出力モード ---
+# ===============================
+elif mode == "データ出力":
+    st.title("データ出力（工場向け）")
+    from export import FORMATS, export_orders
+
+    status_labels = {"すべて": None, "採寸済み": "measured", "注文確定": "completed"}
+    c1, c2 = st.columns(2)
+    status_label = c1.selectbox("ステータス", list(status_labels), key="export_status")
+    fmt = c2.selectbox("形式", ["csv", "parquet"], format_func=lambda f: {"csv": "CSV（gzip圧縮）", "parquet": "Parquet"}[f])
+
+    if st.button("出力ファイルを作成", type="primary"):
+        # 1000件ずつ読み込んで追記するので、注文数が多くてもメモリ使用量は増えない
+        with st.spinner("出力中..."):
+            path, count = export_orders(supabase, catalog, fmt=fmt, status=status_labels[status_label])
+        # 前回作成したファイルは不要になるので消しておく
+        if st.session_state.get("export_file"):
+            try:
+                os.remove(st.session_state.export_file[0])
+            except FileNotFoundError:
+                # 一時ディレクトリの掃除などで既に消えている
+                pass
+        st.session_state.export_file = (path, count, fmt)
+
+    if st.session_state.get("export_file"):
+        path, count, fmt = st.session_state.export_file
+        st.success(f"{count} 件の注文を出力しました。")
+        with open(path, "rb") as f:
+            st.download_button("ダウンロード", f, file_name=f"orders{FORMATS[fmt]}")
+
+metrics.finish_rerun()
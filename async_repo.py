@@ -0,0 +1,97 @@
+"""orders テーブルの非同期の読み書き（supabase の AsyncClient）
+
+画面の処理で互いに依存しないクエリを1つずつ順に送ると、待ち時間は全クエリの
+往復時間の合計になる。ここではプロセスに1つのイベントループをバックグラウンドの
+スレッドで動かし（Streamlit のスクリプトは同期的に実行されるため）、
+AsyncClient のクエリを同時に送って、待ち時間を一番遅いクエリの分だけにする。
+
+    future = loop.submit(prefetch_orders(aclient, cache, ids))  # 送っておき、同期のクエリと並べて待つ
+    future.result()
+
+書き込みキュー（write_queue.py）は、登録のまとめ送りと受付番号ごとの更新を
+コルーチンの中で asyncio.gather して同時に送る（loop.run で結果を待つ）。
+
+書き込みは応答で反映後の行（採番された id など）を受け取り、読み直さない。
+クエリの組み立てと行の展開は orders_repo.py / measurements.py と共通。
+"""
+import asyncio
+import threading
+
+import metrics
+from measurements import ON_CONFLICT, TABLE, split, to_rows, unpack
+from orders_repo import FULL, select_orders
+
+
+class EventLoop:
+    """バックグラウンドのスレッドで動くイベントループ"""
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-db", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """コルーチンをイベントループで実行し、concurrent.futures.Future を返す"""
+        return asyncio.run_coroutine_threadsafe(metrics.bind(coro), self._loop)
+
+    def run(self, coro, timeout=None):
+        """コルーチンを実行して結果を待つ"""
+        return self.submit(coro).result(timeout)
+
+
+# ===============================
+# --- 読み込み ---
+# ===============================
+async def prefetch_orders(client, cache, order_ids, columns=FULL):
+    """キャッシュに無い注文だけを1回のクエリでまとめて読み込み、キャッシュに入れておく"""
+    missing = [order_id for order_id in order_ids if not cache.contains(order_id, columns)]
+    if not missing:
+        return
+    res = await select_orders(client, columns).in_("id", missing).execute()
+    for row in res.data or []:
+        cache.put(unpack(row), columns)
+
+
+# ===============================
+# --- 書き込み ---
+# ===============================
+async def save_measurements(client, order_id, fields):
+    """採寸値を1回の upsert で保存する（measurements.save と同じ）"""
+    rows = to_rows(order_id, fields)
+    if rows:
+        await client.table(TABLE).upsert(rows, on_conflict=ON_CONFLICT).execute()
+
+
+async def update_order(client, order_id, fields, expected_version=None, columns=("id",)):
+    """更新して、反映後の行（columns と採寸値）を返す
+
+    expected_version を渡すと DB の version が一致する時だけ更新し、一致しない
+    （または注文が無い）時は None を返す。採寸値は orders の更新が通った後に保存する。
+    """
+    order_fields, measured = split(fields)
+    query = client.table("orders").update(order_fields).eq("id", order_id)
+    if expected_version is not None:
+        query = query.eq("version", expected_version)
+    res = await query.select(*columns).execute()
+    if not res.data:
+        return None
+    await save_measurements(client, order_id, measured)
+    return {**res.data[0], **measured}
+
+
+async def insert_orders(client, payloads, key="client_key"):
+    """冪等キー（key 列）付きで登録し、{キー: 受付番号} を返す
+
+    client は events.EventScope で包んだもの（キーはイベントごとに一意）。
+    採番された id は upsert の応答で受け取る。既に登録済みのキー（送り直し）は
+    応答に含まれないので、その分だけを読み直す。
+    """
+    res = await client.table("orders").upsert(
+        payloads, on_conflict=f"event_id,{key}", ignore_duplicates=True, default_to_null=False,
+    ).select("id", key).execute()
+    ids = {row[key]: row["id"] for row in res.data or []}
+    missing = [payload[key] for payload in payloads if payload[key] not in ids]
+    if missing:
+        res = await client.table("orders").select("id", key).in_(key, missing).execute()
+        ids.update({row[key]: row["id"] for row in res.data or []})
+    return ids
@@ -0,0 +1,293 @@
+"""ローカル用の Supabase 代替（プロセス内のメモリ上テーブル）
+
+負荷試験やオフラインでの動作確認用に、アプリが使う範囲の
+supabase-py / postgrest-py のクエリ API（select / insert / update / upsert と
+eq・in_・gt・like・or_ などの絞り込み、order・limit）を同じ書き方で使えるようにする。
+リクエスト数と返したデータ量を数え、latency で通信の往復時間を模擬できる。
+DB関数（rpc）は無いものとして、PostgREST と同じく APIError を返す。
+async_client() は同じテーブルを非同期クライアント（AsyncClient）の書き方で使う。
+defaults には列の既定値（DB側の default 句に相当）をテーブルごとに渡す。
+"""
+import asyncio
+import copy
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from postgrest.exceptions import APIError
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeSupabase:
+    def __init__(self, latency=0.0, defaults=None):
+        self.latency = latency
+        self.defaults = defaults or {}
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._next_id = {}
+        self.requests = 0
+        self.bytes_sent = 0
+
+    # ---- supabase.Client と同じ入口 ----
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    from_ = table
+
+    def rpc(self, fn, params=None, **kwargs):
+        return FakeRpc(self, fn)
+
+    def async_client(self):
+        return AsyncFakeSupabase(self)
+
+    # ---- 試験用の操作 ----
+    def rows(self, name):
+        with self._lock:
+            return copy.deepcopy(self._tables.get(name, []))
+
+    def seed(self, name, rows):
+        with self._lock:
+            for row in rows:
+                self._insert_row(name, dict(row))
+
+    def set_fields(self, name, row_id, fields):
+        """アプリを通さずに行を書き換える（別端末からの更新の模擬）"""
+        with self._lock:
+            for row in self._tables.get(name, []):
+                if row["id"] == row_id:
+                    row.update(fields)
+                    row["updated_at"] = _now()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    # ---- 内部処理 ----
+    def _insert_row(self, name, row):
+        table = self._tables.setdefault(name, [])
+        row = {**copy.deepcopy(self.defaults.get(name, {})), **row}
+        if "id" not in row:
+            row["id"] = self._next_id.get(name, 1)
+        self._next_id[name] = max(self._next_id.get(name, 1), row["id"] + 1)
+        row.setdefault("updated_at", _now())
+        table.append(row)
+        return row
+
+    def _record(self, data):
+        self.requests += 1
+        self.bytes_sent += len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeQuery:
+    def __init__(self, backend, table):
+        self._backend = backend
+        self._table = table
+        self._op = "select"
+        self._payload = None
+        self._columns = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._single = False
+        self._count = None
+        self._embeds = []
+
+    # ---- 操作 ----
+    def select(self, *columns, count=None):
+        cols = [c.strip() for col in columns for c in re.split(r",(?![^(]*\))", col)]
+        # "order_measurements(product,size)" のような埋め込み（子テーブルの行）
+        self._embeds = [m.groups() for m in map(_EMBED.fullmatch, cols) if m]
+        cols = [c for c in cols if not _EMBED.fullmatch(c)]
+        self._columns = None if not cols or "*" in cols else cols
+        self._count = count
+        return self
+
+    def insert(self, data, **kwargs):
+        self._op, self._payload = "insert", data
+        return self
+
+    def update(self, data, **kwargs):
+        self._op, self._payload = "update", data
+        return self
+
+    def upsert(self, data, on_conflict="", ignore_duplicates=False, **kwargs):
+        self._op, self._payload = "upsert", data
+        self._on_conflict, self._ignore_duplicates = on_conflict or "id", ignore_duplicates
+        return self
+
+    # ---- 絞り込み ----
+    def _filter(self, column, test):
+        self._filters.append((column, test))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, lambda v: v is not None and _same(v, value))
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._filter(column, lambda v: any(_same(v, x) for x in values))
+
+    def gt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v > value)
+
+    def gte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v >= value)
+
+    def like(self, column, pattern):
+        return self._filter(column, _pattern_test(pattern, case=True))
+
+    def ilike(self, column, pattern):
+        return self._filter(column, _pattern_test(pattern, case=False))
+
+    def or_(self, filters, **kwargs):
+        """"col.like.abc*,col2.ilike.*x*" 形式（like / ilike / eq のみ）"""
+        tests = []
+        for part in filters.split(","):
+            column, op, value = part.split(".", 2)
+            if op == "eq":
+                tests.append((column, lambda v, value=value: v is not None and _same(v, value)))
+            else:
+                tests.append((column, _pattern_test(value.replace("*", "%"), case=op == "like")))
+        self._filters.append((None, lambda row: any(test(row.get(column)) for column, test in tests)))
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count, **kwargs):
+        self._limit = count
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    maybe_single = single
+
+    # ---- 実行 ----
+    def _matches(self, row):
+        return all(test(row if column is None else row.get(column)) for column, test in self._filters)
+
+    def _project(self, row):
+        if self._columns is None:
+            data = copy.deepcopy(row)
+        else:
+            data = {c: copy.deepcopy(row.get(c)) for c in self._columns}
+        # 子テーブルは「親テーブル名の単数形_id」（orders → order_id）で親を参照しているものとする
+        foreign_key = self._table.rstrip("s") + "_id"
+        for table, columns in self._embeds:
+            children = [r for r in self._backend._tables.get(table, []) if r.get(foreign_key) == row["id"]]
+            names = [c.strip() for c in columns.split(",")]
+            data[table] = [{c: copy.deepcopy(r.get(c)) for c in names} for r in children]
+        return data
+
+    def _run(self):
+        backend = self._backend
+        with backend._lock:
+            table = backend._tables.setdefault(self._table, [])
+            if self._op == "insert":
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                rows = [backend._insert_row(self._table, dict(item)) for item in payload]
+            elif self._op == "upsert":
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                rows = []
+                for item in payload:
+                    keys = self._on_conflict.split(",")
+                    existing = next((r for r in table if all(r.get(k) == item.get(k) for k in keys)), None)
+                    if existing is None:
+                        rows.append(backend._insert_row(self._table, dict(item)))
+                    elif not self._ignore_duplicates:
+                        existing.update(item)
+                        existing["updated_at"] = _now()
+                        rows.append(existing)
+            elif self._op == "update":
+                rows = [r for r in table if self._matches(r)]
+                for row in rows:
+                    row.update(self._payload)
+                    row["updated_at"] = _now()
+            else:
+                rows = [r for r in table if self._matches(r)]
+                for column, desc in reversed(self._order):
+                    rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+                if self._limit is not None:
+                    rows = rows[:self._limit]
+
+            count = len(rows) if self._count else None
+            data = [self._project(r) for r in rows]
+            if self._single:
+                if len(data) != 1:
+                    raise ValueError(f"single() expected 1 row, got {len(data)}")
+                data = data[0]
+            backend._record(data)
+        return FakeResponse(data, count)
+
+    def execute(self):
+        response = self._run()
+        if self._backend.latency:
+            time.sleep(self._backend.latency)
+        return response
+
+
+class AsyncFakeQuery(FakeQuery):
+    async def execute(self):
+        response = self._run()
+        if self._backend.latency:
+            await asyncio.sleep(self._backend.latency)
+        return response
+
+
+class AsyncFakeSupabase:
+    """同じテーブルを supabase.AsyncClient と同じ書き方（await ... .execute()）で使う"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def table(self, name):
+        return AsyncFakeQuery(self._backend, name)
+
+    from_ = table
+
+
+class FakeRpc:
+    def __init__(self, backend, fn):
+        self._backend = backend
+        self._fn = fn
+
+    def execute(self):
+        with self._backend._lock:
+            self._backend._record(None)
+        raise APIError({
+            "message": f"Could not find the function public.{self._fn}", "code": "PGRST202",
+        })
+
+
+_EMBED = re.compile(r"(\w+)\((.*)\)")
+
+
+def _pattern_test(pattern, case):
+    # SQL の LIKE パターン（% と _）を正規表現に変換する
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    compiled = re.compile(regex, 0 if case else re.IGNORECASE)
+    return lambda v: v is not None and compiled.fullmatch(str(v)) is not None
+
+
+def _same(a, b):
+    if isinstance(a, (int, float)) and isinstance(b, str):
+        try:
+            return a == type(a)(b)
+        except ValueError:
+            return False
+    return a == b
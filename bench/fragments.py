@@ -0,0 +1,102 @@
+"""入力操作1回あたりの再実行時間とブラウザへの送信量
+
+お客様画面（usertest.py）で11商品の数量を順に変える操作と、採寸シート
+（admin-1.py）で1商品の備考を書き換える操作を AppTest で繰り返し、
+1操作あたりのスクリプト実行時間と、ブラウザへ送ったメッセージのバイト数を出す。
+フラグメントだけが再実行された操作の割合も表示する。
+
+    python bench/fragments.py [--repeat 5] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import partial_rerun  # noqa: E402
+from loadtest import ROOT, SECRETS, _new_app, _widget, percentile, use_backend  # noqa: E402
+
+partial_rerun.install()
+
+sys.path.insert(0, ROOT)
+from catalog import DEFAULT_CATALOG  # noqa: E402
+
+
+def _login(at, user_id, password):
+    at.run()
+    _widget(at.text_input, "ユーザーID").set_value(user_id)
+    _widget(at.text_input, "パスワード").set_value(password)
+    _widget(at.button, "ログイン").click()
+    at.run()
+    at.run()
+
+
+def order_form(repeat):
+    """お客様画面で商品の数量を1つずつ変える"""
+    use_backend(0.0)
+    at = _new_app("usertest.py")
+    _login(at, SECRETS["USER_ID"], SECRETS["PASSWORD"])
+    runs = []
+    for n in range(repeat):
+        for product in DEFAULT_CATALOG.products:
+            at.selectbox(key=f"cust_qty_{product.key}").set_value((n % 3) + 1)
+            at.run()
+            runs.append(partial_rerun.last_run(at))
+    return runs
+
+
+def measurement_sheet(repeat):
+    """採寸シートで1商品の備考を書き換える（採寸対象の全商品を1点ずつ注文した受付）"""
+    backend = use_backend(0.0)
+    backend.seed("orders", [{
+        "name": "採寸待ち", "status": "waiting", "version": 0,
+        "items": {product.key: 1 for product in DEFAULT_CATALOG.products},
+    }])
+    at = _new_app("admin-1.py")
+    _login(at, SECRETS["ADMIN_ID"], SECRETS["ADMIN_PASSWORD"])
+    at.number_input(key="search_input_field").set_value(1)
+    _widget(at.button, "検索").click()
+    at.run()
+    runs = []
+    for n in range(repeat * 5):
+        at.text_input(key="m_s_blazer").set_value(f"袖丈 +{n}cm")
+        at.run()
+        runs.append(partial_rerun.last_run(at))
+    return runs
+
+
+def summarize(runs):
+    ms = [run["ms"] for run in runs]
+    return {
+        "count": len(runs),
+        "p50_ms": round(percentile(ms, 0.50), 2),
+        "p95_ms": round(percentile(ms, 0.95), 2),
+        "bytes_per_interaction": round(sum(run["bytes"] for run in runs) / len(runs)),
+        "fragment_only": round(sum(run["fragment"] for run in runs) / len(runs), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果をJSONで保存する")
+    args = parser.parse_args()
+
+    result = {
+        "customer/quantity": summarize(order_form(args.repeat)),
+        "staff/memo": summarize(measurement_sheet(args.repeat)),
+    }
+    print(f"{'interaction':<20}{'n':>6}{'p50ms':>10}{'p95ms':>10}{'bytes/op':>10}{'fragment':>10}")
+    for name, s in result.items():
+        print(
+            f"{name:<20}{s['count']:>6}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+            f"{s['bytes_per_interaction']:>10}{s['fragment_only']:>10}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""複数セッションの負荷試験
+
+お客様 N 人（usertest.py: ログイン → 入力 → 確認 → 採寸待ち → 完了）と
+スタッフ M 人（admin-1.py: ログイン → 検索 → 採寸入力 → 保存 → 確定 → 注文一覧）を
+Streamlit の AppTest で同時に動かし、DBはプロセス内の FakeSupabase に差し替える。
+AppTest は1プロセス内で並列に実行できないため、全セッションを1回の再実行ずつ
+交互に進める（共有キャッシュや状態監視は1台のサーバーと同じく共有される）。
+
+画面（フェーズ）ごとに再実行時間の p50 / p95 / p99、1操作あたりのDBリクエスト数と
+受信バイト数、1セッションあたりのメモリ使用量を出力する。
+
+    python bench/loadtest.py --customers 20 --staff 5 --latency 0.02
+    python bench/loadtest.py --save-baseline   # 結果を基準値として保存
+    python bench/loadtest.py --compare         # 基準値より p95 が悪化したら終了コード 1
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+import partial_rerun  # noqa: E402
+import streamlit as st  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+# フラグメントだけの再実行でも、画面全体の要素を引き継いで操作できるようにする
+partial_rerun.install()
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "baseline.json")
+# 試験用の行はすべて既定のイベント（ログイン情報を最上位に置いた SECRETS のイベント）に入れる
+ORDER_DEFAULTS = {"orders": {"version": 0, "event_id": 1}, "order_measurements": {"event_id": 1}}
+SECRETS = {
+    "USER_ID": "kiosk", "PASSWORD": "kiosk-pass",
+    "ADMIN_ID": "staff", "ADMIN_PASSWORD": "staff-pass",
+}
+
+
+# ===============================
+# --- 計測 ---
+# ===============================
+class Recorder:
+    """フェーズごとの再実行時間と、その間に発生したDBリクエストを記録する"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = defaultdict(list)
+
+    def run(self, at, app, phase):
+        start = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{app}/{phase}: {at.exception[0].value}")
+        self.latencies[f"{app}/{phase}"].append(elapsed)
+
+
+class Calibrator(Recorder):
+    """1セッションずつ動かし、1操作あたりのDBリクエスト数と受信バイト数を数える"""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.requests = defaultdict(list)
+        self.bytes = defaultdict(list)
+
+    def run(self, at, app, phase):
+        before = (self.backend.requests, self.backend.bytes_sent)
+        super().run(at, app, phase)
+        self.requests[f"{app}/{phase}"].append(self.backend.requests - before[0])
+        self.bytes[f"{app}/{phase}"].append(self.backend.bytes_sent - before[1])
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+# ===============================
+# --- シナリオ ---
+# ===============================
+def _widget(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+def _new_app(script):
+    at = AppTest.from_file(os.path.join(ROOT, script), default_timeout=30)
+    for key, value in SECRETS.items():
+        at.secrets[key] = value
+    return at
+
+
+# シナリオは「次に再実行するフェーズ名」を yield するジェネレーター。
+# None を yield した回は何もしない（画面の切り替わり待ち）。
+def customer_flow(at, backend, n, wait_timeout=15.0, poll_interval=1.0):
+    yield "login"
+    _widget(at.text_input, "ユーザーID").set_value(SECRETS["USER_ID"])
+    _widget(at.text_input, "パスワード").set_value(SECRETS["PASSWORD"])
+    _widget(at.button, "ログイン").click()
+    yield "login"
+
+    _widget(at.text_input, "お名前（必須）").set_value(f"お客様{n}")
+    at.text_input[1].set_value("6068275")
+    _widget(at.text_input, "住所（必須）").set_value("京都府京都市左京区北白川")
+    yield "input"
+    for key, qty in (("blazer", 1), ("shirt", 2), ("pants", 1)):
+        at.selectbox(key=f"cust_qty_{key}").set_value(qty)
+        yield "input"
+    _widget(at.button, "確認画面へ進む").click()
+    yield "input"
+
+    _widget(at.button, "採寸する").click()
+    yield "confirm"
+    order_id = at.session_state.order_id
+
+    # スタッフの採寸完了を模擬し、画面が切り替わるまで poll_interval ごとに再実行する
+    backend.set_fields("orders", order_id, {"status": "measured"})
+    deadline = time.monotonic() + wait_timeout
+    label = "ご注文内容へ（これ以降は数量の変更等はできません）"
+    last_run = time.monotonic()
+    while not any(b.label == label for b in at.button):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"customer/complete: 受付番号 {order_id} の採寸完了が反映されません")
+        if time.monotonic() - last_run < poll_interval:
+            yield None
+            continue
+        last_run = time.monotonic()
+        yield "complete"
+    _widget(at.button, label).click()
+    yield "complete"
+    yield "done"
+
+
+def staff_flow(at, backend, order_ids):
+    yield "login"
+    _widget(at.text_input, "ユーザーID").set_value(SECRETS["ADMIN_ID"])
+    _widget(at.text_input, "パスワード").set_value(SECRETS["ADMIN_PASSWORD"])
+    _widget(at.button, "ログイン").click()
+    yield "login"
+    yield "login"
+
+    for order_id in order_ids:
+        at.number_input(key="search_input_field").set_value(order_id)
+        _widget(at.button, "検索").click()
+        yield "search"
+        at.selectbox(key="s_blazer").set_value("L")
+        yield "edit"
+        at.text_input(key="l_pants").set_value("74")
+        yield "edit"
+        _widget(at.button, "一時保存").click()
+        yield "save"
+        _widget(at.button, "全ての採寸を完了して確定する").click()
+        yield "confirm"
+
+    at.sidebar.radio[0].set_value("注文一覧")
+    yield "list"
+
+
+def run_sessions(rec, sessions):
+    """(app名, AppTest, シナリオ) の一覧を1回の再実行ずつ交互に進める"""
+    active = list(sessions)
+    while active:
+        idle = True
+        for session in list(active):
+            app, at, flow = session
+            try:
+                phase = next(flow)
+            except StopIteration:
+                active.remove(session)
+                continue
+            if phase is not None:
+                rec.run(at, app, phase)
+                idle = False
+        if idle and active:
+            time.sleep(0.1)
+
+
+# ===============================
+# --- 実行 ---
+# ===============================
+def seed_staff_orders(backend, count):
+    before = {row["id"] for row in backend.rows("orders")}
+    backend.seed("orders", [
+        {"name": f"採寸待ち{i}", "status": "waiting", "items": {"blazer": 1, "pants": 1, "shirt": 2}}
+        for i in range(count)
+    ])
+    return sorted({row["id"] for row in backend.rows("orders")} - before)
+
+
+def use_backend(latency):
+    """DBを新しい FakeSupabase に差し替え、前回の実行で共有されたキャッシュを捨てる"""
+    backend = FakeSupabase(latency=latency, defaults=ORDER_DEFAULTS)
+    db.get_client = lambda role="anon": backend
+    db.get_async_client = lambda role="anon": backend.async_client()
+    # 書き込みキューのジャーナルも実行ごとに空のものを使う
+    SECRETS["WRITE_QUEUE_DIR"] = tempfile.mkdtemp(prefix="loadtest-writes-")
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    return backend
+
+
+def calibrate(latency):
+    backend = use_backend(latency)
+    cal = Calibrator(backend)
+    customer = _new_app("usertest.py")
+    run_sessions(cal, [("customer", customer, customer_flow(customer, backend, 0))])
+    staff = _new_app("admin-1.py")
+    run_sessions(cal, [("staff", staff, staff_flow(staff, backend, seed_staff_orders(backend, 1)))])
+    return cal
+
+
+def load(customers, staff, orders_per_staff, latency):
+    backend = use_backend(latency)
+    rec = Recorder(backend)
+    assignments = [seed_staff_orders(backend, orders_per_staff) for _ in range(staff)]
+
+    tracemalloc.start()
+    baseline_memory = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for n in range(customers):
+        at = _new_app("usertest.py")
+        sessions.append(("customer", at, customer_flow(at, backend, n)))
+    for order_ids in assignments:
+        at = _new_app("admin-1.py")
+        sessions.append(("staff", at, staff_flow(at, backend, order_ids)))
+    run_sessions(rec, sessions)
+    memory = tracemalloc.get_traced_memory()[0] - baseline_memory
+    tracemalloc.stop()
+    return rec, memory / max(len(sessions), 1)
+
+
+def summarize(cal, rec, memory_per_session, config):
+    phases = {}
+    for phase in sorted(rec.latencies):
+        values = rec.latencies[phase]
+        phases[phase] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "db_requests_per_interaction": round(sum(cal.requests[phase]) / max(len(cal.requests[phase]), 1), 2),
+            "bytes_per_interaction": round(sum(cal.bytes[phase]) / max(len(cal.bytes[phase]), 1)),
+        }
+    return {
+        "config": config,
+        "phases": phases,
+        "memory_per_session_kb": round(memory_per_session / 1024, 1),
+    }
+
+
+def print_report(result):
+    print(f"{'phase':<20}{'n':>6}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'db/op':>8}{'bytes/op':>10}")
+    for phase, s in result["phases"].items():
+        print(
+            f"{phase:<20}{s['count']:>6}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}"
+            f"{s['db_requests_per_interaction']:>8}{s['bytes_per_interaction']:>10}"
+        )
+    print(f"memory per session: {result['memory_per_session_kb']} KiB")
+
+
+def compare(result, baseline, tolerance):
+    """基準値より p95 が tolerance を超えて悪化したフェーズを返す"""
+    regressions = []
+    for phase, s in result["phases"].items():
+        base = baseline["phases"].get(phase)
+        if base and s["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{phase}: p95 {base['p95_ms']}ms -> {s['p95_ms']}ms")
+        if base and s["db_requests_per_interaction"] > base["db_requests_per_interaction"]:
+            regressions.append(
+                f"{phase}: db/op {base['db_requests_per_interaction']} -> {s['db_requests_per_interaction']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=10)
+    parser.add_argument("--staff", type=int, default=3)
+    parser.add_argument("--orders-per-staff", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="DB往復時間の模擬値（秒）")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 の許容悪化率")
+    parser.add_argument("--output", help="結果をJSONで保存する")
+    args = parser.parse_args()
+
+    config = {
+        "customers": args.customers, "staff": args.staff,
+        "orders_per_staff": args.orders_per_staff, "latency": args.latency,
+    }
+    cal = calibrate(args.latency)
+    rec, memory_per_session = load(args.customers, args.staff, args.orders_per_staff, args.latency)
+    result = summarize(cal, rec, memory_per_session, config)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"基準値を保存しました: {BASELINE_PATH}")
+    if args.compare:
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
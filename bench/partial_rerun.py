@@ -0,0 +1,74 @@
+"""AppTest でフラグメント単位の再実行をブラウザと同じように扱う
+
+AppTest は再実行のたびに新しい ScriptRunner を作り、その回に送られた
+ForwardMsg だけから画面を組み立てる。フラグメントだけが再実行された回
+（st.rerun("キー") やフラグメント内の操作）では、フラグメント外の要素が
+画面から消えてしまうため、ブラウザと同じく前回までのメッセージを引き継ぐ。
+あわせて、1回の再実行でスクリプトの実行にかかった時間（AppTest 自体の準備時間を
+除く）と、ブラウザへ送ったメッセージのバイト数を記録する。
+
+    import partial_rerun
+    partial_rerun.install()
+    at.run()
+    partial_rerun.last_run(at)   # {"ms": ..., "bytes": ..., "fragment": True/False}
+"""
+import time
+
+from streamlit.testing.v1 import app_test
+from streamlit.testing.v1.element_tree import parse_tree_from_messages
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+# AppTest のセッション状態ごとの、画面を組み立てたメッセージと前回の再実行の記録
+_messages = {}
+_runs = {}
+
+
+def _is_fragment_run(messages):
+    # フラグメント外の要素（タイトルなど）を1つも送っていなければフラグメントだけの再実行
+    deltas = [msg for msg in messages if msg.WhichOneof("type") == "delta"]
+    return bool(deltas) and all(msg.delta.fragment_id for msg in deltas)
+
+
+class PartialRerunScriptRunner(LocalScriptRunner):
+    def __init__(self, script_path, session_state, *args, **kwargs):
+        super().__init__(script_path, session_state, *args, **kwargs)
+        self._state_id = id(session_state)
+        self._script_seconds = 0.0
+
+    def _run_script(self, rerun_data):
+        # コールバックからの st.rerun で続けて実行された分も含める
+        start = time.perf_counter()
+        try:
+            return super()._run_script(rerun_data)
+        finally:
+            self._script_seconds += time.perf_counter() - start
+
+    def run(self, *args, **kwargs):
+        super().run(*args, **kwargs)
+        sent = list(self.forward_msgs())
+        messages = sent
+        fragment_run = _is_fragment_run(sent)
+        if fragment_run:
+            # 再実行したフラグメントの古い要素だけを差し替える
+            fragments = {msg.delta.fragment_id for msg in sent if msg.WhichOneof("type") == "delta"}
+            kept = [
+                msg for msg in _messages.get(self._state_id, [])
+                if msg.WhichOneof("type") == "delta" and msg.delta.fragment_id not in fragments
+            ]
+            messages = kept + sent
+        _messages[self._state_id] = messages
+        _runs[self._state_id] = {
+            "ms": self._script_seconds * 1000,
+            "bytes": sum(msg.ByteSize() for msg in sent),
+            "fragment": fragment_run,
+        }
+        return parse_tree_from_messages(messages)
+
+
+def install():
+    app_test.LocalScriptRunner = PartialRerunScriptRunner
+
+
+def last_run(at):
+    """直前の再実行の記録"""
+    return _runs.get(id(at._session_state))
@@ -0,0 +1,105 @@
+"""アプリごとの起動直後の表示時間（time-to-first-paint）
+
+停止していたアプリの最初のアクセスを模擬するため、アプリごとに新しい Python
+プロセスを起動し、AppTest で最初の画面（ログイン画面）を描き終わるまでの時間を
+測る。streamlit 本体の読み込みと初回実行の準備にかかる時間（実際のサーバーでは
+起動時に済んでいる）は、空のアプリを先に1回実行して別に表示する。あわせて、ログイン画面の表示中に別スレッドで進める事前読み込み
+（startup.warm_up）が終わるまでの時間も測る。
+
+    python bench/startup.py [--repeat 5] [--output results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = {"usertest": "usertest.py", "admin": "admin-1.py"}
+# 事前読み込みでクライアントを作るための設定（作るだけで通信はしない）
+SECRETS = {
+    "USER_ID": "kiosk", "PASSWORD": "kiosk-pass",
+    "ADMIN_ID": "staff", "ADMIN_PASSWORD": "staff-pass",
+    "SUPABASE_URL": "http://127.0.0.1:9", "SUPABASE_KEY": "anon", "SUPABASE_SERVICE_ROLE_KEY": "service",
+}
+
+
+def measure(app):
+    """子プロセスで1回だけ測る"""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    # streamlit 本体の初回実行の準備（コンポーネントの探索など）も、サーバーの起動時に済んでいる分
+    server = AppTest.from_string("import streamlit as st")
+    server.run()
+    streamlit_ms = (time.perf_counter() - start) * 1000
+
+    sys.path.insert(0, ROOT)
+    at = AppTest.from_file(os.path.join(ROOT, APPS[app]), default_timeout=60)
+    # AppTest はインスタンスごとにコンポーネントを探し直すので、探索済みのものを使い回す
+    at._bidi_component_manager = server._bidi_component_manager
+    start = time.perf_counter()
+    at.run()
+    first_paint_ms = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(f"{app}: {at.exception[0].value}")
+
+    import threading
+    warm_up = next((t for t in threading.enumerate() if t.name == f"warm-up-{app}"), None)
+    if warm_up is not None:
+        warm_up.join()
+    warm_up_ms = (time.perf_counter() - start) * 1000
+    return {"streamlit_ms": streamlit_ms, "first_paint_ms": first_paint_ms, "warm_up_ms": warm_up_ms}
+
+
+def median(values):
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+
+def _workdir():
+    # AppTest の secrets はスクリプトの実行中しか見えず、事前読み込みのスレッドからは
+    # 読めないので、作業ディレクトリの .streamlit/secrets.toml に書いて渡す
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    os.makedirs(os.path.join(workdir, ".streamlit"))
+    secrets = {**SECRETS, "WRITE_QUEUE_DIR": os.path.join(workdir, "data")}
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.writelines(f"{key} = {json.dumps(value)}\n" for key, value in secrets.items())
+    return workdir
+
+
+def run(app, repeat):
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", app],
+            capture_output=True, text=True, check=True, cwd=_workdir(),
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: round(median([s[key] for s in samples]), 1) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果をJSONで保存する")
+    parser.add_argument("--child", choices=list(APPS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    result = {app: run(app, args.repeat) for app in APPS}
+    print(f"{'app':<12}{'streamlit ms':>14}{'first paint ms':>16}{'warm-up ms':>12}")
+    for app, r in result.items():
+        print(f"{app:<12}{r['streamlit_ms']:>14}{r['first_paint_ms']:>16}{r['warm_up_ms']:>12}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""商品マスタ
+
+注文画面（usertest.py）と採寸画面（admin-1.py）で共通の商品マスタ。
+選択肢や「値 → 選択肢の位置」の辞書、価格ベクトルはプロセス内で1回だけ
+組み立て、以降は変更できない形で共有する。
+DBの product_catalog テーブル（sql/003_product_catalog.sql）からも読み込める。
+"""
+from dataclasses import dataclass
+from operator import mul
+from types import MappingProxyType
+
+# ===============================
+# --- 商品仕様 ---
+# ===============================
+# label: お客様向けの表示名 / sheet_label: 採寸シートでの表示名
+# kind : 採寸の入力形式（None は採寸不要）
+PRODUCT_SPECS = {
+    "blazer":       {"label": "ブレザー",               "sheet_label": "ブレザー",       "price": 12000, "kind": "qty_size_memo", "size_options": ["S","M","L","XL"], "types": ["Aタイプ", "Bタイプ"]},
+    "shirt":        {"label": "シャツ",                 "sheet_label": "シャツ",         "price": 2000,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+    "pants":        {"label": "ズボン",                 "sheet_label": "スラックス",     "price": 3000,  "kind": "pants", "waist_range": (61, 111, 3), "length_placeholder": "72"},
+    "vest":         {"label": "ベスト",                 "sheet_label": "ベスト",         "price": 4000,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+    "sweater":      {"label": "セーター",               "sheet_label": "セーター",       "price": 4500,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+    "necktie":      {"label": "ネクタイ",               "sheet_label": "ネクタイ",       "price": 1500,  "kind": None},
+    "sandals":      {"label": "サンダル",               "sheet_label": "サンダル",       "price": 1800,  "kind": "qty_size_memo", "size_options": {"range": (22, 31, 0.5)}},
+    "pe_shirt":     {"label": "体操服（半袖）",         "sheet_label": "体操服（上）",   "price": 2200,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+    "pe_halfpants": {"label": "体操服（ハーフパンツ）", "sheet_label": "ハーフパンツ",   "price": 2000,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+    "pe_jacket":    {"label": "体操服（ジャージ上着）", "sheet_label": "ジャージ（上）", "price": 5000,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+    "pe_pants":     {"label": "体操服（パンツ）",       "sheet_label": "ジャージ（下）", "price": 3800,  "kind": "qty_size_memo", "size_options": ["S","M","L","XL"]},
+}
+
+
+@dataclass(frozen=True)
+class Product:
+    key: str
+    label: str
+    sheet_label: str
+    price: int
+    kind: str | None
+    size_options: tuple
+    size_index: MappingProxyType
+    types: tuple
+    type_index: MappingProxyType
+    waist_options: tuple
+    waist_index: MappingProxyType
+    length_placeholder: str
+
+    def option_index(self, field, value):
+        """DBの値が選択肢の何番目かを返す（見つからなければ先頭）"""
+        if field == "waist":
+            try:
+                value = int(float(value))
+            except (TypeError, ValueError):
+                return 0
+        index = {"size": self.size_index, "type": self.type_index, "waist": self.waist_index}[field]
+        if value in index:
+            return index[value]
+        # 採寸値は文字列で保存されるので、数値の選択肢（サンダルのサイズなど）は文字列で探す
+        return next((i for option, i in index.items() if str(option) == str(value)), 0)
+
+
+@dataclass(frozen=True)
+class Catalog:
+    version: int
+    products: tuple
+    by_key: MappingProxyType
+    keys: tuple
+    # 採寸が必要な商品
+    measured: tuple
+    # products と同じ並びの単価
+    prices: tuple
+
+    def quantity_vector(self, quantities):
+        return tuple(int(quantities.get(product.key) or 0) for product in self.products)
+
+    def total(self, quantities):
+        """数量 × 単価の合計（数量ベクトルと価格ベクトルの内積）"""
+        return sum(map(mul, self.quantity_vector(quantities), self.prices))
+
+
+# ===============================
+# --- 組み立て ---
+# ===============================
+def _range_options(start, end, step):
+    count = int(round((end - start) / step)) + 1
+    if step % 1 == 0:
+        return tuple(int(start + i * step) for i in range(count))
+    return tuple(start + i * step for i in range(count))
+
+
+def _indexed(options):
+    return tuple(options), MappingProxyType({value: i for i, value in enumerate(options)})
+
+
+def compile_product(key, spec):
+    size_opt = spec.get("size_options") or ()
+    if isinstance(size_opt, dict) and "range" in size_opt:
+        size_opt = _range_options(*size_opt["range"])
+    sizes, size_index = _indexed(size_opt)
+    types, type_index = _indexed(spec.get("types") or ())
+    waist_range = spec.get("waist_range")
+    waists, waist_index = _indexed(range(*waist_range) if waist_range else ())
+    return Product(
+        key=key,
+        label=spec["label"],
+        sheet_label=spec.get("sheet_label") or spec["label"],
+        price=int(spec["price"]),
+        kind=spec.get("kind"),
+        size_options=sizes,
+        size_index=size_index,
+        types=types,
+        type_index=type_index,
+        waist_options=waists,
+        waist_index=waist_index,
+        length_placeholder=spec.get("length_placeholder") or "",
+    )
+
+
+def compile_catalog(specs, version=0):
+    products = tuple(compile_product(key, spec) for key, spec in specs.items())
+    return Catalog(
+        version=version,
+        products=products,
+        by_key=MappingProxyType({product.key: product for product in products}),
+        keys=tuple(product.key for product in products),
+        measured=tuple(product for product in products if product.kind),
+        prices=tuple(product.price for product in products),
+    )
+
+
+# 既定の商品マスタ（import 時に1回だけ組み立てる）
+DEFAULT_CATALOG = compile_catalog(PRODUCT_SPECS)
+
+
+# ===============================
+# --- DBからの読み込み ---
+# ===============================
+def fetch_catalog_version(client):
+    """product_catalog の最新バージョンを返す（行がなければ None）"""
+    res = client.table("product_catalog").select("version").order("version", desc=True).limit(1).execute()
+    return res.data[0]["version"] if res.data else None
+
+
+def fetch_catalog(client, version):
+    res = (
+        client.table("product_catalog").select("key", "spec")
+        .eq("version", version).order("sort_order")
+        .execute()
+    )
+    return compile_catalog({row["key"]: row["spec"] for row in res.data or []}, version=version)
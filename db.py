@@ -0,0 +1,139 @@
+"""Supabase クライアントの共有
+
+Streamlit は操作のたびにスクリプト全体を再実行するため、各アプリで
+create_client を直接呼ぶと再実行のたびに HTTP セッション（と TLS 接続）が
+作り直される。ここではキー（ロール）ごとに1つのクライアントをサーバー
+プロセス内で共有し、keep-alive の接続プールを使い回す。
+クエリを同時に送るための非同期クライアントも同じようにロールごとに共有する
+（async_repo.py）。
+ログイン画面の表示中に startup.warm_up が別スレッドから作っておくので、
+スピナーは出さない。
+注文キャッシュ・書き込みキュー・商品マスタはイベント（events.py）ごとに持ち、
+1つのイベントの負荷が他のイベントのキャッシュを追い出したり、送信を待たせたりしない。
+
+st.secrets で調整できる項目（省略時は既定値）:
+    SUPABASE_POOL_SIZE  同時接続数の上限
+    SUPABASE_TIMEOUT    1リクエストのタイムアウト秒数
+    SUPABASE_RETRIES    接続失敗時の再試行回数（指数バックオフ）
+    ORDER_CACHE_SIZE    注文キャッシュの最大件数（イベントごと）
+    ORDER_CACHE_TTL     注文キャッシュの有効秒数
+    CATALOG_FROM_DB     True なら商品マスタを product_catalog テーブルから読む
+    WRITE_QUEUE_DIR     書き込みキュー（SQLite ジャーナル）を置くディレクトリ
+"""
+import os
+
+import httpx
+import streamlit as st
+from supabase import AsyncClient, AsyncClientOptions, Client, ClientOptions, acreate_client, create_client
+
+import metrics
+from async_repo import EventLoop
+from catalog import DEFAULT_CATALOG, Catalog, fetch_catalog, fetch_catalog_version
+from events import EventScope
+from order_cache import OrderCache
+from write_queue import WriteQueue
+
+# ロール → st.secrets のキー名
+ROLE_KEYS = {
+    "anon": "SUPABASE_KEY",
+    "service": "SUPABASE_SERVICE_ROLE_KEY",
+}
+
+
+def _setting(name, default):
+    return type(default)(st.secrets.get(name, default))
+
+
+@st.cache_resource(show_spinner=False)
+def get_client(role="anon") -> Client:
+    """ロールごとに共有される Supabase クライアントを返す"""
+    pool_size = _setting("SUPABASE_POOL_SIZE", 20)
+    timeout = _setting("SUPABASE_TIMEOUT", 10.0)
+    # 接続確立に失敗した場合だけ再試行する（リクエスト未送信なので書き込みも安全）
+    transport = httpx.HTTPTransport(
+        retries=_setting("SUPABASE_RETRIES", 3),
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=60.0,
+        ),
+    )
+    options = ClientOptions(
+        postgrest_client_timeout=timeout,
+        # 再実行ごとの計測（metrics.py）のため、全リクエストの時間とサイズを記録する
+        httpx_client=httpx.Client(
+            transport=transport, timeout=timeout, event_hooks=metrics.httpx_event_hooks(),
+        ),
+    )
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets[ROLE_KEYS[role]], options=options)
+
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> EventLoop:
+    """非同期クエリを実行するイベントループ（プロセスに1つ）"""
+    return EventLoop()
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_client(role="anon") -> AsyncClient:
+    """ロールごとに共有される非同期の Supabase クライアントを返す（get_event_loop のループで使う）"""
+    pool_size = _setting("SUPABASE_POOL_SIZE", 20)
+    timeout = _setting("SUPABASE_TIMEOUT", 10.0)
+    transport = httpx.AsyncHTTPTransport(
+        retries=_setting("SUPABASE_RETRIES", 3),
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=60.0,
+        ),
+    )
+    options = AsyncClientOptions(
+        postgrest_client_timeout=timeout,
+        httpx_client=httpx.AsyncClient(
+            transport=transport, timeout=timeout, event_hooks=metrics.async_httpx_event_hooks(),
+        ),
+    )
+    return get_event_loop().run(
+        acreate_client(st.secrets["SUPABASE_URL"], st.secrets[ROLE_KEYS[role]], options=options)
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_order_cache(event_id) -> OrderCache:
+    """イベントごとにサーバープロセス内で共有される注文キャッシュを返す"""
+    return OrderCache(
+        max_size=_setting("ORDER_CACHE_SIZE", 1024),
+        ttl=_setting("ORDER_CACHE_TTL", 30.0),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_write_queue(role, event_id) -> WriteQueue:
+    """ロール・イベントごとに共有される書き込みキューを返す（送信スレッドも起動する）"""
+    directory = _setting("WRITE_QUEUE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    return WriteQueue(
+        EventScope(get_async_client(role), event_id),
+        os.path.join(directory, f"writes_{role}_{event_id}.sqlite3"), get_event_loop(),
+        cache=get_order_cache(event_id),
+    ).start()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _catalog_version(event_id):
+    # 商品マスタが更新されたかどうかは1分に1回だけ確認する
+    return fetch_catalog_version(EventScope(get_client("anon"), event_id))
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _load_catalog(event_id, version):
+    return fetch_catalog(EventScope(get_client("anon"), event_id), version)
+
+
+def get_catalog(event_id) -> Catalog:
+    """イベントの商品マスタを返す。DBのバージョンが上がった時だけ組み立て直す"""
+    if not _setting("CATALOG_FROM_DB", False):
+        return DEFAULT_CATALOG
+    version = _catalog_version(event_id)
+    if version is None:
+        return DEFAULT_CATALOG
+    return _load_catalog(event_id, version)
@@ -0,0 +1,126 @@
+"""イベント（学校ごとの採寸会）単位の分割
+
+注文・採寸値・商品マスタはイベントごとに分かれており（sql/009_events.sql で
+orders・order_measurements を event_id のリストパーティションにした）、
+ログイン情報もイベントごとに st.secrets の [events.<コード>] に置く:
+
+    [events.school-a]
+    id = 2                    # events.id
+    name = "○○高校"
+    USER_ID = "..."           # お客様用端末（usertest.py）
+    PASSWORD = "..."
+    ADMIN_ID = "..."          # スタッフ用（admin-1.py）
+    ADMIN_PASSWORD = "..."
+
+[events] が無い場合は、従来どおり最上位の USER_ID などを既定のイベント（id = 1）の
+ログイン情報として使う。
+
+DBへの読み書きは EventScope で包んだクライアントで行い、全クエリを1つのイベント
+（1つのパーティション）に絞る。
+"""
+import hmac
+from dataclasses import dataclass
+
+import streamlit as st
+
+DEFAULT_EVENT_ID = 1
+# event_id 列を持ち、イベントで絞り込むテーブル
+SCOPED_TABLES = ("orders", "order_measurements", "product_catalog")
+# ログインの種類 → st.secrets のキー名
+LOGIN_KEYS = {
+    "user": ("USER_ID", "PASSWORD"),
+    "admin": ("ADMIN_ID", "ADMIN_PASSWORD"),
+}
+
+
+@dataclass(frozen=True)
+class Event:
+    id: int
+    code: str
+    name: str
+
+
+# ===============================
+# --- ログイン ---
+# ===============================
+def _configured():
+    """(Event, ログイン情報) の一覧"""
+    sections = st.secrets.get("events")
+    if not sections:
+        return [(Event(DEFAULT_EVENT_ID, "default", ""), st.secrets)]
+    return [
+        (Event(int(section["id"]), code, section.get("name", code)), section)
+        for code, section in sections.items()
+    ]
+
+
+def authenticate(kind, user_id, password):
+    """ログイン情報が一致したイベントを返す（どれとも一致しなければ None）"""
+    id_key, password_key = LOGIN_KEYS[kind]
+    for event, secrets in _configured():
+        if id_key not in secrets or password_key not in secrets:
+            continue
+        # どこで一致しなくなったかが応答時間から分からないよう、両方を比較する
+        id_ok = hmac.compare_digest(str(user_id).encode(), str(secrets[id_key]).encode())
+        password_ok = hmac.compare_digest(str(password).encode(), str(secrets[password_key]).encode())
+        if id_ok and password_ok:
+            return event
+    return None
+
+
+def default_event():
+    """ログイン画面の無いアプリ（user-1.py）が使うイベント"""
+    configured = [event for event, _ in _configured()]
+    return next((event for event in configured if event.id == DEFAULT_EVENT_ID), configured[0])
+
+
+# ===============================
+# --- イベントで絞り込むクライアント ---
+# ===============================
+def _with_event(data, event_id):
+    if isinstance(data, list):
+        return [{**row, "event_id": event_id} for row in data]
+    return {**data, "event_id": event_id}
+
+
+class _ScopedTable:
+    def __init__(self, builder, event_id):
+        self._builder = builder
+        self._event_id = event_id
+
+    def select(self, *columns, **kwargs):
+        return self._builder.select(*columns, **kwargs).eq("event_id", self._event_id)
+
+    def update(self, data, **kwargs):
+        return self._builder.update(data, **kwargs).eq("event_id", self._event_id)
+
+    def delete(self, **kwargs):
+        return self._builder.delete(**kwargs).eq("event_id", self._event_id)
+
+    def insert(self, data, **kwargs):
+        return self._builder.insert(_with_event(data, self._event_id), **kwargs)
+
+    def upsert(self, data, **kwargs):
+        return self._builder.upsert(_with_event(data, self._event_id), **kwargs)
+
+
+class EventScope:
+    """1つのイベントの行だけを読み書きするクライアント
+
+    supabase の Client・AsyncClient（と bench の FakeSupabase）を包み、
+    SCOPED_TABLES の select・update・delete には event_id の絞り込みを、
+    insert・upsert には event_id を付ける。RPC には p_event_id を渡す。
+    """
+
+    def __init__(self, client, event_id):
+        self._client = client
+        self.event_id = event_id
+
+    def table(self, name):
+        builder = self._client.table(name)
+        return _ScopedTable(builder, self.event_id) if name in SCOPED_TABLES else builder
+
+    from_ = table
+
+    def rpc(self, fn, params=None, **kwargs):
+        return self._client.rpc(fn, {**(params or {}), "p_event_id": self.event_id}, **kwargs)
@@ -0,0 +1,82 @@
+"""工場向けの注文・採寸データ出力
+
+orders を id のキーセットで chunk_size 件ずつ（採寸値は order_measurements を
+埋め込んで同じリクエストで）読み、items（JSONB）の数量と商品ごとの採寸列を
+pandas で1チャンク分ずつ平坦化して、圧縮 CSV または Parquet に追記していく。メモリに載るのは常に1チャンク分だけなので、
+注文が 500 件でも 50 万件でも使用量はほぼ変わらない。
+"""
+import gzip
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from orders_repo import iter_chunks, measurement_columns, select_orders
+
+CUSTOMER_COLUMNS = ("id", "name", "zipcode", "address", "phone", "email", "status", "total_price")
+FORMATS = {"csv": ".csv.gz", "parquet": ".parquet"}
+
+
+def export_columns(catalog):
+    """出力ファイルの列（数量は qty_<商品キー>）"""
+    return (
+        CUSTOMER_COLUMNS
+        + tuple(f"qty_{key}" for key in catalog.keys)
+        + measurement_columns(catalog)
+    )
+
+
+def flatten(rows, catalog):
+    """1チャンク分の行を出力用の DataFrame にする"""
+    # object 型のまま読み込み、欠損を含む整数列（ウエストなど）が小数（76.0）にならないようにする
+    df = pd.DataFrame(rows, dtype=object)
+    items = df.pop("items") if "items" in df else pd.Series([None] * len(df))
+    quantities = pd.json_normalize([x or {} for x in items]).reindex(columns=list(catalog.keys))
+    quantities.columns = [f"qty_{key}" for key in catalog.keys]
+    df = pd.concat([df, quantities.set_index(df.index)], axis=1)
+
+    columns = export_columns(catalog)
+    df = df.reindex(columns=list(columns))
+    # チャンクごとに型が変わらないよう、数値列以外は文字列にそろえる
+    numeric = ["id", "total_price"] + [c for c in columns if c.startswith("qty_")]
+    df[numeric] = df[numeric].apply(pd.to_numeric, errors="coerce").fillna(0).astype("int64")
+    text = [c for c in columns if c not in numeric]
+    df[text] = df[text].astype("string")
+    return df
+
+
+def _schema(catalog):
+    fields = []
+    for column in export_columns(catalog):
+        numeric = column in ("id", "total_price") or column.startswith("qty_")
+        fields.append(pa.field(column, pa.int64() if numeric else pa.string()))
+    return pa.schema(fields)
+
+
+def export_orders(client, catalog, fmt="csv", chunk_size=1000, status=None):
+    """一時ファイルに書き出してパスと件数を返す"""
+    columns = CUSTOMER_COLUMNS + ("items",) + measurement_columns(catalog)
+
+    def query():
+        q = select_orders(client, columns)
+        return q.eq("status", status) if status else q
+
+    fd, path = tempfile.mkstemp(prefix="orders_", suffix=FORMATS[fmt])
+    os.close(fd)
+    count = 0
+    if fmt == "csv":
+        with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as f:
+            for i, rows in enumerate(iter_chunks(query, chunk_size)):
+                flatten(rows, catalog).to_csv(f, header=(i == 0), index=False)
+                count += len(rows)
+            if count == 0:
+                pd.DataFrame(columns=list(export_columns(catalog))).to_csv(f, index=False)
+    else:
+        schema = _schema(catalog)
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for rows in iter_chunks(query, chunk_size):
+                writer.write_table(pa.Table.from_pandas(flatten(rows, catalog), schema=schema, preserve_index=False))
+                count += len(rows)
+    return path, count
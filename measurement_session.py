@@ -0,0 +1,128 @@
+"""採寸入力の編集セッション
+
+商品ブロックをまたいで変更された項目だけを覚えておき、保存時に
+1回の update にまとめて送る。orders.version による楽観的排他制御で、
+同じ受付番号を別のスタッフが先に保存していた場合は上書きせずに
+ConflictError を送出する（sql/002_orders_version.sql）。
+採寸値は order_measurements に商品ごとの行として保存し（measurements.py）、
+orders は version と status だけを更新する。
+
+writes（write_queue.WriteQueue）を渡すと保存は書き込みキューに記録するだけで
+すぐに戻る。競合は送信後に分かるので、次の保存・確認時に ConflictError になる。
+"""
+import time
+
+from measurements import is_measurement_column, split
+from measurements import save as save_measurements
+
+
+class ConflictError(Exception):
+    """他のスタッフが先に同じ注文を保存していた"""
+
+
+class MeasurementSession:
+    def __init__(self, client, order, cache=None, writes=None):
+        self._client = client
+        # 保存結果を反映する注文キャッシュ（order_cache.OrderCache）
+        self._cache = cache
+        self._writes = writes
+        self._last_key = None
+        self.order = dict(order)
+        self.version = order.get("version") or 0
+        self._pending = {}
+        # 画面に表示している値（選択肢の初期値を含む。確定時に defaults() で使う）
+        self._shown = {}
+        self._changed_at = None
+
+    @property
+    def order_id(self):
+        return self.order["id"]
+
+    @property
+    def dirty(self):
+        return bool(self._pending)
+
+    def set(self, field, value):
+        """画面の値を記録する。DBの値と同じなら未保存の変更から外す"""
+        if _same(self.order.get(field), value):
+            self._pending.pop(field, None)
+        elif self._pending.get(field, object()) != value:
+            self._pending[field] = value
+            self._changed_at = time.monotonic()
+
+    def show(self, fields):
+        """画面に表示した値を覚えておく（スタッフが変えた項目ではないので未保存の変更にはしない）"""
+        self._shown.update(fields)
+
+    def defaults(self):
+        """DBに値が無く、画面には初期値（選択肢の先頭など）が表示されている項目"""
+        return {
+            field: value for field, value in self._shown.items()
+            if field not in self._pending and _same(self.order.get(field), None) and not _same(value, None)
+        }
+
+    def flush(self, extra=None):
+        """未保存の変更（と extra）を1回の update で保存する。保存したら True"""
+        diff = dict(self._pending)
+        diff.update(extra or {})
+        if not diff:
+            return False
+        # 採寸値は商品単位の行で保存するので、変更した商品は全項目を送る
+        touched = {column.rpartition("_")[0] for column in diff if is_measurement_column(column)}
+        for column, value in self.order.items():
+            if is_measurement_column(column) and column.rpartition("_")[0] in touched:
+                diff.setdefault(column, value)
+        diff["version"] = self.version + 1
+        if self._writes is not None:
+            self.check()
+            # キャッシュへの反映は書き込みキューが行う
+            self._last_key = self._writes.update(self.order_id, diff, expected_version=self.version)
+        else:
+            order_fields, measured = split(diff)
+            res = (
+                self._client.table("orders").update(order_fields)
+                .eq("id", self.order_id).eq("version", self.version)
+                .select("id", "version")
+                .execute()
+            )
+            if not res.data:
+                raise ConflictError(f"受付番号 {self.order_id} は他のスタッフによって更新されています。")
+            save_measurements(self._client, self.order_id, measured)
+            if self._cache is not None:
+                self._cache.merge(self.order_id, diff)
+        self.order.update(diff)
+        self.version = diff["version"]
+        self._pending.clear()
+        self._changed_at = None
+        return True
+
+    @property
+    def syncing(self):
+        """書き込みキューに記録した保存がまだ送信されていなければ True"""
+        if self._writes is None or self._last_key is None:
+            return False
+        result = self._writes.result(self._last_key)
+        return result is not None and result["state"] == "pending"
+
+    def check(self):
+        """書き込みキュー経由の前回の保存が競合・失敗していたら ConflictError を送出する"""
+        if self._writes is None or self._last_key is None:
+            return
+        result = self._writes.result(self._last_key)
+        if result is not None and result["state"] in ("conflict", "failed"):
+            self._last_key = None
+            raise ConflictError(f"受付番号 {self.order_id} の保存が反映されませんでした（{result['error']}）。")
+
+    def autosave(self, delay=3.0):
+        """最後の変更から delay 秒たっていれば保存する（入力中は待つ）"""
+        if self._changed_at is None or time.monotonic() - self._changed_at < delay:
+            return False
+        return self.flush()
+
+
+def _same(a, b):
+    # order_measurements.size は文字列なので、数値の選択肢（サンダルのサイズなど）とは文字列で比べる。
+    # 未入力（DB の NULL）と空欄の入力欄（""）は同じとみなす
+    if a is None or b is None:
+        return (a is None or a == "") and (b is None or b == "")
+    return a == b or str(a) == str(b)
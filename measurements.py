@@ -0,0 +1,54 @@
+"""採寸データ（order_measurements: 注文 × 商品ごとに1行）
+
+採寸値はもともと orders の「{商品キー}_{項目}」列（blazer_size、pants_waist など）に
+持っていたが、商品を増やすたびに全注文の列が増えていくため、注文・商品ごとの行に
+分けた（sql/008_order_measurements.sql）。画面やキャッシュでは従来どおり
+"pants_waist" のような列名で扱えるよう、ここで行と列名を相互に変換する。
+"""
+TABLE = "order_measurements"
+FIELDS = ("size", "type", "waist", "length", "memo")
+# orders の select に埋め込んで、1回のリクエストで採寸値も取得する
+EMBED = f"{TABLE}(product,{','.join(FIELDS)})"
+# 主キー（event_id はイベントごとのクライアント（events.EventScope）が付ける）
+ON_CONFLICT = "event_id,order_id,product"
+
+
+def is_measurement_column(column):
+    product, _, field = column.rpartition("_")
+    return bool(product) and field in FIELDS
+
+
+def split(fields):
+    """更新内容を (orders の列, 採寸値の列) に分ける"""
+    order_fields, measured = {}, {}
+    for column, value in fields.items():
+        (measured if is_measurement_column(column) else order_fields)[column] = value
+    return order_fields, measured
+
+
+def to_rows(order_id, fields):
+    """"{商品キー}_{項目}" の値を商品ごとの行にする（渡されなかった項目は None）"""
+    rows = {}
+    for column, value in fields.items():
+        product, _, field = column.rpartition("_")
+        row = rows.setdefault(product, {"order_id": order_id, "product": product, **dict.fromkeys(FIELDS)})
+        row[field] = value
+    return list(rows.values())
+
+
+def unpack(row):
+    """埋め込みで取得した採寸行を "{商品キー}_{項目}" の列に展開する"""
+    for measured in row.pop(TABLE, None) or []:
+        for field in FIELDS:
+            row[f"{measured['product']}_{field}"] = measured.get(field)
+    return row
+
+
+def save(client, order_id, fields):
+    """採寸値を1回の upsert で保存する
+
+    行は商品単位で置き換わるので、変更した商品は全項目を渡すこと。
+    """
+    rows = to_rows(order_id, fields)
+    if rows:
+        client.table(TABLE).upsert(rows, on_conflict=ON_CONFLICT).execute()
@@ -0,0 +1,277 @@
+"""再実行ごとの計測
+
+環境変数 METRICS_LOG にファイル名を指定すると、スクリプトの再実行1回ごとに
+所要時間と、その間に発生したDB（PostgREST）・外部HTTP呼び出しの時間・行数・
+受信バイト数を JSON Lines で書き出す。各行にはアプリ名・画面（フェーズ）・
+セッションIDが付く。フラグメント（st.fragment）だけの再実行も、fragment で
+包んだ関数なら1回の再実行として記録する（フラグメントのキー付き）。書き込みキュー（write_queue.py）の未送信件数も送信のたびに
+記録する。未指定の場合は何も記録しない。
+
+集計:
+    python metrics.py metrics.jsonl
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+LOG_PATH = os.environ.get("METRICS_LOG")
+
+_lock = threading.Lock()
+_reruns = {}
+# セッションごとの最後のアプリ名と画面（フラグメントだけの再実行の記録に使う）
+_screens = {}
+# イベントループのスレッド（async_repo.py）で実行中のコルーチンが属するセッション
+_bound_session = contextvars.ContextVar("metrics_session", default=None)
+
+
+class Rerun:
+    def __init__(self, app, session_id, phase=None, fragment=None):
+        self.app = app
+        self.phase = phase
+        self.fragment = fragment
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.calls = []
+
+    def to_dict(self, elapsed):
+        return {
+            "type": "rerun",
+            "ts": time.time(),
+            "app": self.app,
+            "phase": self.phase,
+            "fragment": self.fragment,
+            "session": self.session_id,
+            "ms": round(elapsed * 1000, 2),
+            "calls": self.calls,
+        }
+
+
+def enabled():
+    return bool(LOG_PATH)
+
+
+def _session_id():
+    bound = _bound_session.get()
+    if bound is not None:
+        return bound
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else None
+
+
+def bind(coro):
+    """別スレッドのイベントループで実行するコルーチンの呼び出しを、呼び出し元の再実行に含める"""
+    session_id = _session_id()
+
+    async def run():
+        _bound_session.set(session_id)
+        return await coro
+
+    return run()
+
+
+def _write(entry):
+    with _lock:
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# ===============================
+# --- 再実行の開始・終了 ---
+# ===============================
+def start_rerun(app):
+    """スクリプトの先頭で呼ぶ。st.rerun で終わった前回分はここで閉じる"""
+    if not enabled():
+        return
+    session_id = _session_id()
+    finish_rerun()
+    with _lock:
+        _reruns[session_id] = Rerun(app, session_id)
+        _screens[session_id] = (app, None)
+
+
+def set_phase(phase):
+    if not enabled():
+        return
+    session_id = _session_id()
+    rerun = _reruns.get(session_id)
+    if rerun is not None:
+        rerun.phase = phase
+        _screens[session_id] = (rerun.app, phase)
+
+
+def finish_rerun():
+    """スクリプトの末尾（と st.stop の直前）で呼ぶ"""
+    if not enabled():
+        return
+    with _lock:
+        rerun = _reruns.pop(_session_id(), None)
+    if rerun is not None:
+        _write(rerun.to_dict(time.perf_counter() - rerun.started))
+
+
+def fragment(key):
+    """st.fragment にする関数に付ける
+
+    スクリプト全体の再実行の中で呼ばれた時はその再実行に含め、フラグメントだけが
+    再実行された時（入力の変更や run_every）は、最後に表示した画面の再実行として
+    key を付けて記録する。
+
+        @st.fragment(run_every=5)
+        @metrics.fragment("waiting_queue")
+        def waiting_queue(): ...
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            session_id = _session_id()
+            if not enabled() or session_id in _reruns:
+                return func(*args, **kwargs)
+            app, phase = _screens.get(session_id, (None, None))
+            with _lock:
+                _reruns[session_id] = Rerun(app, session_id, phase, fragment=key)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finish_rerun()
+        return run
+    return decorate
+
+
+# ===============================
+# --- 呼び出しの記録 ---
+# ===============================
+def record_call(kind, name, seconds, rows=None, size=None):
+    if not enabled():
+        return
+    call = {"kind": kind, "name": name, "ms": round(seconds * 1000, 2), "rows": rows, "bytes": size}
+    rerun = _reruns.get(_session_id())
+    if rerun is not None:
+        rerun.calls.append(call)
+    else:
+        # 状態監視スレッドなど、再実行の外で発生した呼び出し
+        _write({"type": "call", "ts": time.time(), **call})
+
+
+def record_queue(stats):
+    """書き込みキューの未送信・競合・失敗件数と、最も古い未送信の経過秒数"""
+    if not enabled():
+        return
+    _write({"type": "queue", "ts": time.time(), **stats})
+
+
+@contextmanager
+def timed(kind, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_call(kind, name, time.perf_counter() - start)
+
+
+def _row_count(response):
+    # PostgREST は Content-Range: 0-24/* の形で返した行の範囲を示す
+    content_range = response.headers.get("content-range", "")
+    span = content_range.split("/", 1)[0]
+    if "-" in span:
+        first, last = span.split("-", 1)
+        return int(last) - int(first) + 1
+    return 0 if span == "*" else None
+
+
+def _on_request(request):
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+def _record_response(response):
+    start = response.request.extensions.get("metrics_start", time.perf_counter())
+    path = response.request.url.path.rsplit("/", 1)[-1]
+    record_call(
+        "db", f"{response.request.method} {path}", time.perf_counter() - start,
+        rows=_row_count(response), size=len(response.content),
+    )
+
+
+def _on_response(response):
+    if not enabled():
+        return
+    response.read()
+    _record_response(response)
+
+
+async def _on_request_async(request):
+    _on_request(request)
+
+
+async def _on_response_async(response):
+    if not enabled():
+        return
+    await response.aread()
+    _record_response(response)
+
+
+def httpx_event_hooks():
+    """Supabase クライアントの httpx.Client に渡すイベントフック"""
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+def async_httpx_event_hooks():
+    """非同期クライアント（httpx.AsyncClient）用のイベントフック"""
+    return {"request": [_on_request_async], "response": [_on_response_async]}
+
+
+# ===============================
+# --- 集計 ---
+# ===============================
+def summarize(path):
+    """画面ごとの再実行時間・クエリ数と、時間のかかった呼び出しを表示する"""
+    screens = defaultdict(lambda: {"reruns": 0, "ms": 0.0, "calls": 0, "call_ms": 0.0})
+    call_totals = defaultdict(lambda: {"count": 0, "ms": 0.0, "bytes": 0})
+    queue = {"samples": 0, "max_pending": 0, "max_age": 0.0}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["type"] == "queue":
+                queue["samples"] += 1
+                queue["max_pending"] = max(queue["max_pending"], entry["pending"])
+                queue["max_age"] = max(queue["max_age"], entry["oldest_age"])
+                continue
+            calls = entry["calls"] if entry["type"] == "rerun" else [entry]
+            if entry["type"] == "rerun":
+                phase = entry["phase"] if entry.get("fragment") is None else f"{entry['phase']}[{entry['fragment']}]"
+                screen = screens[(entry["app"], phase)]
+                screen["reruns"] += 1
+                screen["ms"] += entry["ms"]
+                screen["calls"] += len(calls)
+                screen["call_ms"] += sum(c["ms"] for c in calls)
+            for call in calls:
+                total = call_totals[(call["kind"], call["name"])]
+                total["count"] += 1
+                total["ms"] += call["ms"]
+                total["bytes"] += call["bytes"] or 0
+
+    print(f"{'app/phase':<28}{'reruns':>8}{'avg ms':>10}{'calls/rerun':>13}{'call ms/rerun':>15}")
+    for (app, phase), s in sorted(screens.items(), key=lambda kv: -kv[1]["ms"]):
+        n = s["reruns"]
+        print(f"{app + '/' + str(phase):<28}{n:>8}{s['ms'] / n:>10.1f}{s['calls'] / n:>13.2f}{s['call_ms'] / n:>15.1f}")
+    print()
+    print(f"{'call':<40}{'count':>8}{'total ms':>12}{'avg bytes':>12}")
+    for (kind, name), s in sorted(call_totals.items(), key=lambda kv: -kv[1]["ms"]):
+        print(f"{kind + ' ' + name:<40}{s['count']:>8}{s['ms']:>12.1f}{s['bytes'] / s['count']:>12.0f}")
+    if queue["samples"]:
+        print()
+        print(f"write queue: max pending {queue['max_pending']}, oldest pending {queue['max_age']:.1f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("使い方: python metrics.py metrics.jsonl")
+        sys.exit(1)
+    summarize(sys.argv[1])
@@ -0,0 +1,70 @@
+"""orders の商品別の採寸列を order_measurements に移す
+
+sql/008_order_measurements.sql を適用し、アプリを更新した後に1回実行する。
+orders を id のキーセットで chunk_size 件ずつ読み、採寸値のある商品だけを
+1チャンクにつき1回の upsert で書き込む。既に order_measurements にある行
+（更新後のアプリで保存された新しい値）は上書きしないので、途中で止めても
+最初から、または --after-id で続きから何度でも実行し直せる。
+
+    python migrate_measurements.py [--event 1] [--chunk-size 500] [--after-id 0] [--dry-run]
+
+sql/009_events.sql の適用後は、--event で指定したイベントの注文だけを移す。
+
+接続先は .streamlit/secrets.toml（service ロールのキー）を使う。
+"""
+import argparse
+
+from catalog import DEFAULT_CATALOG
+from db import get_catalog, get_client
+from events import DEFAULT_EVENT_ID, EventScope
+from measurements import ON_CONFLICT, TABLE, to_rows
+from orders_repo import measurement_columns
+
+
+def wide_rows(rows, columns):
+    """旧列の値がある商品だけを order_measurements の行にする"""
+    result = []
+    for row in rows:
+        values = {column: row.get(column) for column in columns}
+        products = {column.rpartition("_")[0] for column, value in values.items() if value not in (None, "")}
+        result += to_rows(row["id"], {
+            column: value for column, value in values.items() if column.rpartition("_")[0] in products
+        })
+    return result
+
+
+def migrate(client, catalog=DEFAULT_CATALOG, chunk_size=500, after_id=0, dry_run=False):
+    """移した行数を返す"""
+    columns = measurement_columns(catalog)
+    last_id, migrated = after_id, 0
+    while True:
+        # 旧列を直接読む（orders_repo.select_orders は採寸列を order_measurements から読むため使わない）
+        res = (
+            client.table("orders").select("id", *columns)
+            .gt("id", last_id).order("id").limit(chunk_size)
+            .execute()
+        )
+        rows = res.data or []
+        if not rows:
+            break
+        measured = wide_rows(rows, columns)
+        if measured and not dry_run:
+            client.table(TABLE).upsert(measured, on_conflict=ON_CONFLICT, ignore_duplicates=True).execute()
+        migrated += len(measured)
+        last_id = rows[-1]["id"]
+        print(f"受付番号 {last_id} まで: {migrated} 行")
+        if len(rows) < chunk_size:
+            break
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--event", type=int, default=DEFAULT_EVENT_ID, help="イベントID（events.id）")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--after-id", type=int, default=0, help="この受付番号より後から再開する")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに件数だけ数える")
+    args = parser.parse_args()
+    client = EventScope(get_client("service"), args.event)
+    count = migrate(client, get_catalog(args.event), args.chunk_size, args.after_id, args.dry_run)
+    print(f"{count} 行を{'移行対象として数えました' if args.dry_run else '移行しました'}")
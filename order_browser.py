@@ -0,0 +1,90 @@
+"""管理画面の注文一覧用スナップショット
+
+注文一覧に必要な列だけをプロセス内に保持し、2回目以降は updated_at が
+前回の透かし（watermark）の少し前以降の行だけを取り直す（コミットの遅れた書き込みも
+拾うため。読み直した行は id で置き換わるだけ）。ページ送りはメモリ上の
+スナップショットを id のキーセットで切り出すだけなので、DBには問い合わせない。
+orders に updated_at 列が必要（sql/001_orders_updated_at.sql）。
+採寸待ちの列は waiting_since（sql/005_orders_waiting_since.sql）の古い順に並べる。
+"""
+import bisect
+import threading
+import time
+
+from orders_repo import iter_chunks, since_watermark
+
+LIST_COLUMNS = ("id", "name", "status", "updated_at")
+QUEUE_COLUMNS = LIST_COLUMNS + ("waiting_since",)
+
+
+class OrderSnapshot:
+    def __init__(self, client, status=None, columns=LIST_COLUMNS, chunk_size=1000, min_refresh=5.0):
+        self._client = client
+        self.columns = columns
+        # None なら全ステータス。初回の読み込みはDB側で絞り込む
+        self.status = status
+        self.chunk_size = chunk_size
+        # この秒数以内の再描画ではDBに問い合わせない
+        self.min_refresh = min_refresh
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._ids = []
+        self._watermark = None
+        self._refreshed_at = 0.0
+
+    def _query(self):
+        return self._client.table("orders").select(*self.columns)
+
+    def _fetch_chunks(self, query_factory):
+        for rows in iter_chunks(query_factory, self.chunk_size):
+            yield from rows
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < self.min_refresh:
+                return
+            if self._watermark is None:
+                def initial():
+                    query = self._query()
+                    return query.eq("status", self.status) if self.status else query
+                changed = self._fetch_chunks(initial)
+            else:
+                # ステータスが変わって対象外になった行も拾うため、差分はステータスで絞らない
+                since = since_watermark(self._watermark)
+                changed = self._fetch_chunks(lambda: self._query().gte("updated_at", since))
+
+            for row in changed:
+                if self.status and row.get("status") != self.status:
+                    self._rows.pop(row["id"], None)
+                else:
+                    self._rows[row["id"]] = row
+                updated_at = row.get("updated_at")
+                if updated_at and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+            self._ids = sorted(self._rows)
+            self._refreshed_at = time.monotonic()
+
+    def page(self, after_id=0, limit=50):
+        """after_id より大きい id を limit 件返す"""
+        self.refresh()
+        with self._lock:
+            start = bisect.bisect_right(self._ids, after_id)
+            return [self._rows[order_id] for order_id in self._ids[start:start + limit]]
+
+    def oldest(self, limit=None, refresh=True):
+        """待ち始めの古い順に返す（waiting_since が無い環境では updated_at で代用する）
+
+        refresh=False ならDBに問い合わせず、前回取得した内容だけから返す。
+        """
+        if refresh:
+            self.refresh()
+        with self._lock:
+            rows = sorted(
+                self._rows.values(),
+                key=lambda row: (row.get("waiting_since") or row.get("updated_at") or "", row["id"]),
+            )
+        return rows[:limit]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
@@ -0,0 +1,85 @@
+"""受付番号ごとの注文キャッシュ
+
+同じ注文を再実行のたびに select し直さないよう、取得した行をプロセス内に
+保持する。TTL と件数上限（古いものから追い出す）を持ち、アプリ自身の
+insert / update の結果はその場でキャッシュにも反映する（ライトスルー）。
+画面ごとに取得する列が違うため、行と一緒に「どの列を持っているか」を覚え、
+要求された列がそろっている時だけヒットとする。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class OrderCache:
+    def __init__(self, max_size=1024, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, order_id, columns=None):
+        """columns の列をすべて持つ行を返す（None は全列）"""
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is not None and entry[2] < time.monotonic():
+                self._entries.pop(order_id)
+                entry = None
+            if entry is None or not _covers(entry[1], columns):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(order_id)
+            self.hits += 1
+            return dict(entry[0])
+
+    def contains(self, order_id, columns=None):
+        """get と同じ条件でヒットするかだけを返す（先読みの判定用。ヒット率には数えない）"""
+        with self._lock:
+            entry = self._entries.get(order_id)
+            return entry is not None and entry[2] >= time.monotonic() and _covers(entry[1], columns)
+
+    def put(self, row, columns=None):
+        """取得した行を保存する。columns は取得した列（None は全列）"""
+        known = None if columns is None else frozenset(columns) | frozenset(row)
+        with self._lock:
+            entry = self._entries.get(row["id"])
+            if entry is not None and entry[2] >= time.monotonic():
+                # 有効期限内の行があれば列を足し合わせる
+                row = {**entry[0], **row}
+                known = None if entry[1] is None or known is None else entry[1] | known
+            self._entries[row["id"]] = (dict(row), known, time.monotonic() + self.ttl)
+            self._entries.move_to_end(row["id"])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def merge(self, order_id, fields):
+        """キャッシュ済みの行に更新内容を反映する（未キャッシュなら何もしない）"""
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is not None:
+                known = None if entry[1] is None else entry[1] | frozenset(fields)
+                self._entries[order_id] = ({**entry[0], **fields}, known, time.monotonic() + self.ttl)
+
+    def invalidate(self, order_id):
+        with self._lock:
+            self._entries.pop(order_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _covers(known, columns):
+    if known is None:
+        return True
+    if columns is None:
+        return False
+    return known.issuperset(columns)
@@ -0,0 +1,88 @@
+"""管理画面のお客様検索（名前・電話番号・メールアドレス・郵便番号）
+
+入力の形から検索する列を決め、索引が効く条件（sql/006_orders_search.sql）だけで
+DBに問い合わせる。
+    - @ を含む        : メールアドレスの部分一致（トライグラム索引）
+    - 数字のみ        : 電話番号（数字のみ）・郵便番号の前方一致
+    - それ以外        : 名前の部分一致（2文字以下は前方一致。英数字なら
+                        メールアドレスの部分一致も含める）
+結果は件数を limit で打ち切り、最近の検索結果をプロセス内に短時間保持する。
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+SEARCH_COLUMNS = ("id", "name", "zipcode", "phone", "email", "status")
+# これより短い入力では検索しない（候補が多すぎて絞り込みにならない）
+MIN_DIGITS = 3
+MIN_TEXT = 2
+# トライグラム索引が使えるのは3文字以上の部分一致
+TRIGRAM_LENGTH = 3
+
+# PostgREST のフィルタ構文やLIKEで特別な意味を持つ文字は取り除く（_ は1文字の
+# ワイルドカードになるが、メールアドレスに使われるので残す）
+_SPECIAL = re.compile(r"[%*,()\\:\"]")
+
+
+def normalize(text):
+    text = _SPECIAL.sub("", text.strip())
+    digits = re.sub(r"[-\s]", "", text)
+    if digits.isdigit():
+        return digits
+    return " ".join(text.split())
+
+
+def build_query(client, text, limit):
+    """正規化済みの入力から select クエリを作る（検索しない入力なら None）"""
+    query = client.table("orders").select(*SEARCH_COLUMNS)
+    if "@" in text:
+        if len(text) < MIN_TEXT:
+            return None
+        query = query.ilike("email", f"%{text}%")
+    elif text.isdigit():
+        if len(text) < MIN_DIGITS:
+            return None
+        query = query.or_(f"phone_digits.like.{text}*,zipcode.like.{text}*")
+    else:
+        if len(text) < MIN_TEXT:
+            return None
+        if len(text) < TRIGRAM_LENGTH:
+            query = query.ilike("name", f"{text}%")
+        elif text.isascii():
+            # ローマ字の名前か、@ より前だけを入力したメールアドレス
+            query = query.or_(f"name.ilike.*{text}*,email.ilike.*{text}*")
+        else:
+            query = query.ilike("name", f"%{text}%")
+    return query.order("id", desc=True).limit(limit)
+
+
+class OrderSearch:
+    def __init__(self, client, limit=20, cache_size=256, ttl=30.0):
+        self._client = client
+        self.limit = limit
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()
+
+    def search(self, text):
+        """候補を新しい注文から limit 件返す"""
+        key = normalize(text)
+        with self._lock:
+            entry = self._recent.get(key)
+            if entry is not None and entry[1] >= time.monotonic():
+                self._recent.move_to_end(key)
+                return entry[0]
+
+        query = build_query(self._client, key, self.limit)
+        rows = []
+        if query is not None:
+            rows = query.execute().data or []
+
+        with self._lock:
+            self._recent[key] = (rows, time.monotonic() + self.ttl)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.cache_size:
+                self._recent.popitem(last=False)
+        return rows
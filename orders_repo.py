@@ -0,0 +1,114 @@
+"""orders テーブルの読み込み
+
+orders は顧客情報と items（JSONB）を持ち、画面ごとに必要な列だけを指定して
+取得する。採寸値は order_measurements にあるが、列名（"pants_waist" など）で
+指定すれば埋め込みで同じリクエストで取得し、orders の列と同じように展開して返す
+（measurements.py）。読み込みは order_cache.OrderCache を経由する。
+書き込みは write_queue.py（送信は async_repo.py）が行い、キャッシュにもそこで反映する。
+"""
+from datetime import datetime, timedelta
+
+from measurements import EMBED, is_measurement_column, unpack
+
+# ===============================
+# --- 用途別の列射影 ---
+# ===============================
+# 採寸状況の確認（待機画面）
+STATUS = ("id", "status")
+# 全列
+FULL = None
+
+# updated_at は書き込んだトランザクションの開始時刻（now()）なので、コミットが遅れた行は
+# 既に読んだ行より前の時刻で見えるようになる。差分はこの秒数だけ透かしより前から読み直す
+WATERMARK_OVERLAP = 5.0
+
+
+def measurement_columns(catalog):
+    """商品マスタから採寸入力で読み書きする列名を返す"""
+    columns = []
+    for product in catalog.measured:
+        if product.types:
+            columns.append(f"{product.key}_type")
+        if product.kind == "pants":
+            columns += [f"{product.key}_waist", f"{product.key}_length", f"{product.key}_memo"]
+        elif product.kind == "qty_size_memo":
+            columns += [f"{product.key}_size", f"{product.key}_memo"]
+    return tuple(columns)
+
+
+def measurement_sheet(catalog):
+    """採寸シート（管理画面）で使う列"""
+    return ("id", "name", "items", "status", "version") + measurement_columns(catalog)
+
+
+def select_orders(client, columns=FULL):
+    """orders の select クエリ。採寸列が含まれていれば採寸行を埋め込む（結果は unpack で展開）"""
+    if columns is None:
+        return client.table("orders").select("*", EMBED)
+    order_columns = [column for column in columns if not is_measurement_column(column)]
+    if len(order_columns) < len(columns):
+        order_columns.append(EMBED)
+    return client.table("orders").select(*order_columns)
+
+
+# ===============================
+# --- 読み込み ---
+# ===============================
+def get_order(client, cache, order_id, columns=FULL, fresh=False, writes=None):
+    """注文を1件返す。fresh=True ならキャッシュを使わずにDBから読み直す
+
+    writes（write_queue.WriteQueue）を渡すと、DBから読んだ行にまだ送信していない
+    更新を重ねて返す。
+    """
+    if not fresh:
+        row = cache.get(order_id, columns)
+        if row is not None:
+            return row
+    res = select_orders(client, columns).eq("id", order_id).execute()
+    if not res.data:
+        cache.invalidate(order_id)
+        return None
+    row = unpack(res.data[0])
+    if writes is not None:
+        row = writes.overlay(row, columns)
+    cache.put(row, columns)
+    return row
+
+
+def prefetch_orders(client, cache, order_ids, columns=FULL):
+    """キャッシュに無い注文だけを1回のクエリでまとめて読み込み、キャッシュに入れておく"""
+    missing = [order_id for order_id in order_ids if not cache.contains(order_id, columns)]
+    if not missing:
+        return
+    res = select_orders(client, columns).in_("id", missing).execute()
+    for row in res.data or []:
+        cache.put(unpack(row), columns)
+
+
+def iter_chunks(query_factory, chunk_size=1000):
+    """id のキーセットで chunk_size 件ずつ取得し、1チャンク（行のリスト）ずつ返す
+
+    query_factory は絞り込み済みの select クエリを毎回新しく作る関数
+    （select_orders で採寸列を含めた場合も展開済みの行を返す）。
+    """
+    last_id = 0
+    while True:
+        res = query_factory().gt("id", last_id).order("id").limit(chunk_size).execute()
+        rows = [unpack(row) for row in res.data or []]
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def since_watermark(watermark, overlap=WATERMARK_OVERLAP):
+    """差分の読み込みを始める時刻（透かしの overlap 秒前）"""
+    return (datetime.fromisoformat(watermark) - timedelta(seconds=overlap)).isoformat()
+
+
+def get_statuses(client, order_ids):
+    """複数の注文のステータスを1回のクエリでまとめて返す"""
+    res = select_orders(client, STATUS).in_("id", list(order_ids)).execute()
+    return {row["id"]: row["status"] for row in res.data or []}
+
@@ -0,0 +1,17 @@
+-- 注文一覧の差分更新用: 行が更新されるたびに updated_at を進める
+alter table orders add column if not exists updated_at timestamptz not null default now();
+
+create or replace function set_updated_at() returns trigger as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists orders_set_updated_at on orders;
+create trigger orders_set_updated_at
+  before update on orders
+  for each row execute function set_updated_at();
+
+create index if not exists orders_updated_at_idx on orders (updated_at);
+create index if not exists orders_status_id_idx on orders (status, id);
@@ -0,0 +1,2 @@
+-- 採寸入力の楽観的排他制御用: 保存のたびにアプリ側で +1 する
+alter table orders add column if not exists version integer not null default 0;
@@ -0,0 +1,9 @@
+-- 商品マスタ: 変更時は version を上げた行一式を追加する（アプリは最新 version を読む）
+create table if not exists product_catalog (
+  version    integer not null,
+  key        text    not null,
+  sort_order integer not null default 0,
+  spec       jsonb   not null,  -- catalog.PRODUCT_SPECS の1商品分と同じ形
+  primary key (version, key)
+);
+create index if not exists product_catalog_version_idx on product_catalog (version desc);
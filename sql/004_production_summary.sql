@@ -0,0 +1,27 @@
+-- 生産集計（商品 × サイズ × タイプ × ウエスト）。当時の catalog.py の商品マスタの採寸列から作ったもの。
+-- 採寸値を order_measurements に移した sql/008_order_measurements.sql で置き換えられ、
+-- 商品を追加しても作り直す必要はなくなった（生成に使っていた関数も削除済み）
+create or replace function production_summary(p_statuses text[] default array['measured', 'completed'])
+returns table (product text, size text, type text, waist text, quantity bigint)
+language sql stable as $$
+  select m.product, m.size, m.type, m.waist,
+         sum((o.items ->> m.product)::int)::bigint as quantity
+  from orders o
+  cross join lateral (values
+    ('blazer', o.blazer_size::text, o.blazer_type::text, null::text),
+    ('shirt', o.shirt_size::text, null::text, null::text),
+    ('pants', null::text, null::text, o.pants_waist::text),
+    ('vest', o.vest_size::text, null::text, null::text),
+    ('sweater', o.sweater_size::text, null::text, null::text),
+    ('necktie', null::text, null::text, null::text),
+    ('sandals', o.sandals_size::text, null::text, null::text),
+    ('pe_shirt', o.pe_shirt_size::text, null::text, null::text),
+    ('pe_halfpants', o.pe_halfpants_size::text, null::text, null::text),
+    ('pe_jacket', o.pe_jacket_size::text, null::text, null::text),
+    ('pe_pants', o.pe_pants_size::text, null::text, null::text)
+  ) as m(product, size, type, waist)
+  where o.status = any(p_statuses)
+    and coalesce((o.items ->> m.product)::int, 0) > 0
+  group by 1, 2, 3, 4
+  order by 1, 2, 3, 4
+$$;
@@ -0,0 +1,19 @@
+-- 採寸待ちの列の並び順用: 注文が採寸待ちになった時刻を記録する
+-- （updated_at は採寸の一時保存でも進むため、待ち時間には使えない）
+alter table orders add column if not exists waiting_since timestamptz;
+
+create or replace function set_waiting_since() returns trigger as $$
+begin
+  if new.status = 'waiting' and (tg_op = 'INSERT' or old.status is distinct from 'waiting') then
+    new.waiting_since := now();
+  end if;
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists orders_set_waiting_since on orders;
+create trigger orders_set_waiting_since
+  before insert or update on orders
+  for each row execute function set_waiting_since();
+
+update orders set waiting_since = updated_at where status = 'waiting' and waiting_since is null;
@@ -0,0 +1,14 @@
+-- 管理画面のお客様検索用の索引（order_search.py）
+create extension if not exists pg_trgm;
+
+-- 電話番号はハイフンの有無を問わず前方一致で探せるよう、数字だけの列を持つ
+alter table orders add column if not exists phone_digits text
+  generated always as (regexp_replace(coalesce(phone, ''), '[^0-9]', '', 'g')) stored;
+
+-- 名前・メールアドレスの部分一致（3文字以上）
+create index if not exists orders_name_trgm_idx on orders using gin (name gin_trgm_ops);
+create index if not exists orders_email_trgm_idx on orders using gin (email gin_trgm_ops);
+-- 名前（2文字以下）・郵便番号・電話番号の前方一致
+create index if not exists orders_name_prefix_idx on orders (name text_pattern_ops);
+create index if not exists orders_zipcode_prefix_idx on orders (zipcode text_pattern_ops);
+create index if not exists orders_phone_digits_prefix_idx on orders (phone_digits text_pattern_ops);
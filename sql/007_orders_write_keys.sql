@@ -0,0 +1,6 @@
+-- 書き込みキュー（write_queue.py）の冪等キー
+-- client_key: 登録ごとの一意キー。送り直しや連打でも同じ注文は1件しか登録されない
+alter table orders add column if not exists client_key uuid;
+create unique index if not exists orders_client_key_idx on orders (client_key);
+-- write_key: 最後に反映した更新のキー。送り直した更新が反映済みかどうかの判定に使う
+alter table orders add column if not exists write_key uuid;
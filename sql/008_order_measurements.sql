@@ -0,0 +1,45 @@
+-- 採寸値を orders の商品別の列から、注文 × 商品ごとの行に移す（measurements.py）
+-- 適用の手順:
+--   1. このファイルを実行する
+--   2. アプリを更新する（以降の採寸は order_measurements に保存される）
+--   3. python migrate_measurements.py で既存の注文の採寸値を移す
+--   4. 移行を確認したら、末尾のコメントにある orders の旧列を削除する
+create table if not exists order_measurements (
+  order_id bigint not null references orders (id) on delete cascade,
+  product text not null,
+  size text,
+  type text,
+  waist integer,
+  length text,
+  memo text,
+  updated_at timestamptz not null default now(),
+  primary key (order_id, product)
+);
+
+drop trigger if exists order_measurements_set_updated_at on order_measurements;
+create trigger order_measurements_set_updated_at
+  before update on order_measurements
+  for each row execute function set_updated_at();
+
+-- 生産集計（商品・サイズ・タイプ・ウエスト別）用
+create index if not exists order_measurements_product_idx on order_measurements (product, size, type, waist);
+
+-- 生産集計は items の数量と採寸行を突き合わせるだけになり、商品マスタから生成する必要がなくなった
+create or replace function production_summary(p_statuses text[] default array['measured', 'completed'])
+returns table (product text, size text, type text, waist text, quantity bigint)
+language sql stable as $$
+  select i.product, m.size, m.type, m.waist::text,
+         sum(i.qty::int)::bigint as quantity
+  from orders o
+  cross join lateral jsonb_each_text(o.items) as i(product, qty)
+  left join order_measurements m on m.order_id = o.id and m.product = i.product
+  where o.status = any(p_statuses)
+    and i.qty::int > 0
+  group by 1, 2, 3, 4
+  order by 1, 2, 3, 4
+$$;
+
+-- 4. 旧列の削除（商品ごとに実行する）
+-- alter table orders
+--   drop column if exists blazer_size, drop column if exists blazer_type, drop column if exists blazer_memo,
+--   drop column if exists pants_waist, drop column if exists pants_length, drop column if exists pants_memo, ...;
@@ -0,0 +1,226 @@
+-- イベント（学校ごとの採寸会）単位の分割（events.py）
+-- orders・order_measurements を event_id のリストパーティションに作り直し、索引もイベントごとに持つ。
+-- 1つの学校の注文が増えても、他の学校の一覧・検索・集計は自分のパーティションだけを読む。
+-- 適用の手順:
+--   1. アプリを止めてから（書き込みキューの送信が終わってから）このファイルを実行する
+--      既存の注文・採寸値・商品マスタは既定のイベント（id = 1）に入る
+--   2. st.secrets にイベントごとのログイン情報（[events.<コード>]）を追加して、アプリを更新する
+--   3. 移行を確認したら、末尾のコメントにある旧テーブルを削除する
+-- 行レベルセキュリティ（RLS）・ポリシー・権限は旧テーブルのものを新しい親テーブルに付け直す。
+-- パーティションは PostgREST からも別テーブルとして見えるので、RLS を有効にしてポリシーを付けず、
+-- 親テーブルを通さない読み書きはできないようにする（service ロールは RLS の対象外）。
+-- イベントの追加は events に行を入れるだけでよい（パーティションはトリガーで作られる）:
+--   insert into events (code, name) values ('school-a', '○○高校') returning id;
+
+create table if not exists events (
+  id bigint generated by default as identity primary key,
+  code text not null unique,
+  name text not null default '',
+  created_at timestamptz not null default now()
+);
+alter table events enable row level security;
+insert into events (id, code) values (1, 'default') on conflict (id) do nothing;
+select setval(pg_get_serial_sequence('events', 'id'), greatest((select max(id) from events), 1));
+
+-- ===============================
+-- 旧テーブルを退避する（索引名が重ならないよう、索引にも _old を付ける）
+-- ===============================
+alter table order_measurements rename to order_measurements_old;
+alter table orders rename to orders_old;
+
+do $$
+declare
+  idx record;
+begin
+  for idx in
+    select c.relname from pg_index i
+    join pg_class c on c.oid = i.indexrelid
+    where i.indrelid in ('orders_old'::regclass, 'order_measurements_old'::regclass)
+  loop
+    execute format('alter index %I rename to %I', idx.relname, idx.relname || '_old');
+  end loop;
+end;
+$$;
+
+-- ===============================
+-- orders
+-- ===============================
+-- 主キー・一意制約にはパーティションキー（event_id）を含める必要がある
+create table orders (
+  like orders_old including defaults including generated including identity,
+  event_id bigint not null default 1 references events (id),
+  primary key (event_id, id),
+  unique (event_id, client_key)
+) partition by list (event_id);
+
+-- 親テーブルに作った索引は、パーティションごとの索引として作られる
+create index orders_updated_at_idx on orders (event_id, updated_at);
+create index orders_status_id_idx on orders (event_id, status, id);
+create index orders_name_trgm_idx on orders using gin (name gin_trgm_ops);
+create index orders_email_trgm_idx on orders using gin (email gin_trgm_ops);
+create index orders_name_prefix_idx on orders (name text_pattern_ops);
+create index orders_zipcode_prefix_idx on orders (zipcode text_pattern_ops);
+create index orders_phone_digits_prefix_idx on orders (phone_digits text_pattern_ops);
+
+-- ===============================
+-- order_measurements
+-- ===============================
+create table order_measurements (
+  event_id bigint not null default 1,
+  order_id bigint not null,
+  product text not null,
+  size text,
+  type text,
+  waist integer,
+  length text,
+  memo text,
+  updated_at timestamptz not null default now(),
+  primary key (event_id, order_id, product),
+  foreign key (event_id, order_id) references orders (event_id, id) on delete cascade
+) partition by list (event_id);
+
+create index order_measurements_product_idx on order_measurements (event_id, product, size, type, waist);
+
+-- ===============================
+-- イベントを追加したらパーティションを作る
+-- ===============================
+create or replace function create_event_partitions(p_event_id bigint) returns void as $$
+declare
+  parent text;
+begin
+  foreach parent in array array['orders', 'order_measurements'] loop
+    execute format('create table if not exists %I partition of %I for values in (%s)',
+                   parent || '_event_' || p_event_id, parent, p_event_id);
+    execute format('alter table %I enable row level security', parent || '_event_' || p_event_id);
+  end loop;
+end;
+$$ language plpgsql;
+
+create or replace function events_create_partitions() returns trigger as $$
+begin
+  perform create_event_partitions(new.id);
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists events_create_partitions on events;
+create trigger events_create_partitions
+  after insert on events
+  for each row execute function events_create_partitions();
+
+-- 既にあるイベント（既定のイベントを含む）の分
+select create_event_partitions(id) from events;
+
+-- ===============================
+-- 既存の行を既定のイベントに移す
+-- ===============================
+-- updated_at・waiting_since をそのまま移すため、トリガーは移した後に作る
+do $$
+declare
+  cols text;
+begin
+  -- 生成列（phone_digits）は移さない
+  select string_agg(quote_ident(column_name), ', ' order by ordinal_position) into cols
+  from information_schema.columns
+  where table_schema = current_schema() and table_name = 'orders_old' and is_generated = 'NEVER';
+  execute format('insert into orders (%s) overriding system value select %s from orders_old', cols, cols);
+end;
+$$;
+select setval(pg_get_serial_sequence('orders', 'id'), greatest((select max(id) from orders), 1));
+
+insert into order_measurements (order_id, product, size, type, waist, length, memo, updated_at)
+select order_id, product, size, type, waist, length, memo, updated_at from order_measurements_old;
+
+create trigger orders_set_updated_at
+  before update on orders
+  for each row execute function set_updated_at();
+create trigger orders_set_waiting_since
+  before insert or update on orders
+  for each row execute function set_waiting_since();
+create trigger order_measurements_set_updated_at
+  before update on order_measurements
+  for each row execute function set_updated_at();
+
+-- ===============================
+-- RLS・ポリシー・権限を旧テーブルから付け直す（create table ... like では引き継がれない）
+-- ===============================
+do $$
+declare
+  t record;
+  pol record;
+  g record;
+begin
+  for t in
+    select * from (values ('orders_old', 'orders'), ('order_measurements_old', 'order_measurements')) as v(src, dst)
+  loop
+    if (select relrowsecurity from pg_class where oid = t.src::regclass) then
+      execute format('alter table %I enable row level security', t.dst);
+    end if;
+    if (select relforcerowsecurity from pg_class where oid = t.src::regclass) then
+      execute format('alter table %I force row level security', t.dst);
+    end if;
+    for pol in
+      select * from pg_policies where schemaname = current_schema() and tablename = t.src
+    loop
+      execute format('create policy %I on %I as %s for %s to %s%s%s',
+        pol.policyname, t.dst, pol.permissive, pol.cmd,
+        (select string_agg(case when r = 'public' then 'public' else quote_ident(r) end, ', ')
+           from unnest(pol.roles) as r),
+        case when pol.qual is not null then format(' using (%s)', pol.qual) else '' end,
+        case when pol.with_check is not null then format(' with check (%s)', pol.with_check) else '' end);
+    end loop;
+    for g in
+      select grantee, privilege_type from information_schema.role_table_grants
+      where table_schema = current_schema() and table_name = t.src
+    loop
+      execute format('grant %s on %I to %s', g.privilege_type, t.dst,
+        case when g.grantee = 'PUBLIC' then 'public' else quote_ident(g.grantee) end);
+    end loop;
+  end loop;
+end;
+$$;
+
+-- アプリの anon キーは全イベントで共通なので、上のポリシーはイベントを区別しない（イベントの
+-- 絞り込みはアプリの events.EventScope が行う）。DB側でもイベントを分けるには、event_id クレームを
+-- 持つイベントごとの JWT で接続するようにして（アプリは未対応。db.get_client はロールごとのキー）、
+-- 次のポリシーを足す:
+--   create policy orders_event_scope on orders as restrictive to anon, authenticated
+--     using (event_id = (auth.jwt() ->> 'event_id')::bigint)
+--     with check (event_id = (auth.jwt() ->> 'event_id')::bigint);
+--   （order_measurements も同様）
+
+-- ===============================
+-- 商品マスタもイベントごとに持つ
+-- ===============================
+alter table product_catalog add column if not exists event_id bigint not null default 1 references events (id);
+alter table product_catalog drop constraint if exists product_catalog_pkey;
+alter table product_catalog add primary key (event_id, version, key);
+drop index if exists product_catalog_version_idx;
+create index if not exists product_catalog_event_version_idx on product_catalog (event_id, version desc);
+
+-- ===============================
+-- 生産集計もイベントごとに（summary.py）
+-- ===============================
+drop function if exists production_summary(text[]);
+create or replace function production_summary(
+  p_event_id bigint,
+  p_statuses text[] default array['measured', 'completed']
+)
+returns table (product text, size text, type text, waist text, quantity bigint)
+language sql stable as $$
+  select i.product, m.size, m.type, m.waist::text,
+         sum(i.qty::int)::bigint as quantity
+  from orders o
+  cross join lateral jsonb_each_text(o.items) as i(product, qty)
+  left join order_measurements m
+    on m.event_id = o.event_id and m.order_id = o.id and m.product = i.product
+  where o.event_id = p_event_id
+    and o.status = any(p_statuses)
+    and i.qty::int > 0
+  group by 1, 2, 3, 4
+  order by 1, 2, 3, 4
+$$;
+
+-- 3. 旧テーブルの削除
+-- drop table order_measurements_old;
+-- drop table orders_old;
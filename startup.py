@@ -0,0 +1,181 @@
+"""起動の高速化（重いモジュールの事前読み込み）と起動時間の計測
+
+Streamlit Community Cloud ではしばらく使われないとアプリが停止し、朝の最初の
+アクセスでプロセスが起動し直す。ログイン画面は streamlit だけで表示できるので、
+各アプリは supabase・httpx・pandas などを使うモジュールをログイン後に読み込み、
+ログイン画面を表示している間に warm_up で別スレッドから読み込んでおく
+（ロールごとのクライアントもここで作っておく。書き込みキューと商品マスタは
+ログインしたイベントごとに作るので、ログイン後に作る）。
+
+環境変数 STARTUP_PROFILE=1 を付けて起動すると、モジュールごとの読み込み時間と
+初期化（クライアントの作成など）の時間を記録し、事前読み込みが終わった時に
+標準エラーへ表示する。コマンドラインからも計測できる:
+
+    STARTUP_PROFILE=1 streamlit run usertest.py
+    python startup.py admin      # admin-1.py がログイン後に使うモジュールを読み込んで表示
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE = bool(os.environ.get("STARTUP_PROFILE"))
+
+# アプリごとにログイン後に使うモジュール（warm_up で読み込む順）
+APP_MODULES = {
+    "usertest": ("db", "orders_repo", "status_watcher", "write_queue", "zipindex"),
+    "admin": (
+        "db", "order_browser", "measurement_session", "orders_repo", "order_search",
+        "async_repo", "summary", "export",
+    ),
+}
+
+_lock = threading.Lock()
+_started = set()
+_timings = []
+
+
+# ===============================
+# --- 計測 ---
+# ===============================
+def _record(kind, name, seconds, own=None):
+    with _lock:
+        _timings.append({
+            "kind": kind, "name": name, "ms": round(seconds * 1000, 1),
+            "self_ms": round((seconds if own is None else own) * 1000, 1),
+            "thread": threading.current_thread().name,
+        })
+
+
+@contextmanager
+def timed(name):
+    """初期化の処理にかかった時間を記録する（STARTUP_PROFILE の時だけ）"""
+    if not PROFILE:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record("init", name, time.perf_counter() - start)
+
+
+class _TimedLoader:
+    """モジュールの実行時間を、入れ子で読み込んだモジュールの分を除いて測る"""
+    _stack = threading.local()
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._stack.__dict__.setdefault("frames", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            # 読み込み後のモジュールからは元のローダーが見えるようにしておく
+            module.__loader__ = self._loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self._loader
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            _record("import", module.__name__, elapsed, elapsed - nested)
+
+
+class _TimedFinder:
+    """他のファインダーが見つけたモジュールのローダーを _TimedLoader で包む"""
+
+    @staticmethod
+    def find_spec(name, path=None, target=None):
+        for finder in sys.meta_path:
+            if isinstance(finder, _TimedFinder) or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+def install_profiler():
+    """以降のモジュールの読み込み時間を記録する"""
+    if not any(isinstance(finder, _TimedFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _TimedFinder())
+
+
+def report(limit=25, stream=None):
+    """時間のかかった読み込み・初期化を表示する"""
+    stream = stream or sys.stderr
+    with _lock:
+        timings = sorted(_timings, key=lambda t: -t["ms"])
+    print(f"{'kind':<8}{'name':<40}{'ms':>10}{'self ms':>10}  thread", file=stream)
+    for t in timings[:limit]:
+        print(f"{t['kind']:<8}{t['name']:<40}{t['ms']:>10}{t['self_ms']:>10}  {t['thread']}", file=stream)
+    return timings
+
+
+if PROFILE:
+    install_profiler()
+
+
+# ===============================
+# --- 事前読み込み ---
+# ===============================
+def _warm_up(app, role):
+    with timed(f"warm_up({app})"):
+        for name in APP_MODULES[app]:
+            importlib.import_module(name)
+        if "zipindex" in APP_MODULES[app]:
+            # 索引を開いておく（無ければ data/ken_all.zip から作り始める。ZIPINDEX_DOWNLOAD が無ければ通信はしない）
+            sys.modules["zipindex"].get_index()
+        if role is not None:
+            db = sys.modules["db"]
+            try:
+                with timed(f"get_client({role})"):
+                    db.get_client(role)
+                with timed(f"get_async_client({role})"):
+                    db.get_async_client(role)
+            except Exception:
+                # ログイン後にスクリプトが同じものを作り直すので、エラーはそこで表示される
+                pass
+    if PROFILE:
+        report()
+
+
+def warm_up(app, role=None):
+    """app がログイン後に使うモジュールの読み込みと、role のクライアントの作成を
+    別スレッドで始める（プロセスに1回だけ）"""
+    with _lock:
+        if app in _started:
+            return
+        _started.add(app)
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+    thread = threading.Thread(target=_warm_up, args=(app, role), name=f"warm-up-{app}", daemon=True)
+    # st.cache_resource をスクリプトと同じように使えるようにする
+    add_script_run_ctx(thread, get_script_run_ctx(suppress_warning=True))
+    thread.start()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in APP_MODULES:
+        print(f"使い方: python startup.py {{{','.join(APP_MODULES)}}}")
+        sys.exit(1)
+    install_profiler()
+    PROFILE = True
+    with timed(f"import({sys.argv[1]})"):
+        for module_name in APP_MODULES[sys.argv[1]]:
+            importlib.import_module(module_name)
+    report()
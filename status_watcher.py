@@ -0,0 +1,86 @@
+"""採寸ステータスの共有ウォッチャー
+
+サーバープロセスごとに1つのバックグラウンドスレッドが、購読中の受付番号の
+ステータスを in_("id", [...]) の一括クエリでまとめて取得する。
+各セッションはメモリ上の最新ステータスを読むだけなので、DBへの問い合わせは
+待機中のお客様の人数に関係なく poll_interval ごとに1回で済む。
+"""
+import threading
+import time
+
+# 監視対象のステータス（これ以外になった受付番号は購読を外す）
+WATCHED_STATUSES = ("waiting", "measured")
+
+
+class StatusWatcher:
+    """受付番号ごとのステータスを一括ポーリングし、購読中のセッションへ配る
+
+    fetch は「受付番号のリスト → {受付番号: ステータス}」を返す関数
+    （通常は orders_repo.get_statuses）。
+    テストやローカル環境では辞書を返すだけの偽バックエンドを渡せばよい。
+    """
+
+    def __init__(self, fetch, poll_interval=3.0, lease=60.0):
+        self._fetch = fetch
+        self.poll_interval = poll_interval
+        # この秒数のあいだ status() が呼ばれなかった受付番号は購読を外す
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._statuses = {}
+        self._last_seen = {}
+        self._thread = None
+
+    # ---- セッション側から使う ----
+    def status(self, order_id):
+        """最新のステータスを返す（初回だけは即座に取得する）"""
+        with self._lock:
+            self._last_seen[order_id] = time.monotonic()
+            known = order_id in self._statuses
+        self._ensure_thread()
+        if not known:
+            self.poll_once()
+        with self._lock:
+            return self._statuses.get(order_id)
+
+    def notify(self, order_id, status):
+        """アプリ自身が書き込んだステータスを次のポーリングを待たずに反映する"""
+        with self._lock:
+            self._statuses[order_id] = status
+
+    # ---- ポーリング ----
+    def poll_once(self):
+        now = time.monotonic()
+        with self._lock:
+            for order_id, seen in list(self._last_seen.items()):
+                if now - seen > self.lease:
+                    self._forget(order_id)
+            order_ids = [
+                order_id for order_id in self._last_seen
+                if self._statuses.get(order_id) in WATCHED_STATUSES + (None,)
+            ]
+        if not order_ids:
+            return
+        latest = self._fetch(order_ids)
+        with self._lock:
+            for order_id in order_ids:
+                self._statuses[order_id] = latest.get(order_id)
+
+    def _forget(self, order_id):
+        self._last_seen.pop(order_id, None)
+        self._statuses.pop(order_id, None)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="status-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll_once()
+            except Exception:
+                # 一時的な通信エラーでは止めず、次の周期で取り直す
+                continue
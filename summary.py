@@ -0,0 +1,157 @@
+"""生産数の集計（商品 × サイズ × タイプ × ウエスト）
+
+集計はDBの production_summary 関数（sql/008_order_measurements.sql）で行い、
+管理画面には小さな集計結果だけを返す。関数が無い環境（ローカルの偽バックエンド
+など）では、注文を id のキーセットで読み込んで pandas で集計する。
+どちらの場合も結果はプロセス内に保持し、updated_at が前回の透かし以降の注文が
+あった時だけ集計し直す（pandas の場合は変わった注文の分だけ差し替える）。
+コミットの遅れた書き込みを拾うため透かしの少し前から読み直し、前回と同じ
+updated_at の行は変更とみなさない。
+"""
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+from postgrest.exceptions import APIError
+
+from orders_repo import iter_chunks, measurement_columns, select_orders, since_watermark
+
+SUMMARY_STATUSES = ("measured", "completed")
+GROUP_COLUMNS = ["product", "size", "type", "waist"]
+
+
+def contributions(rows, catalog):
+    """注文ごとの (商品, サイズ, タイプ, ウエスト, 数量) を DataFrame で返す"""
+    # object 型のまま読み込み、欠損を含む整数列（ウエストなど）が小数にならないようにする
+    df = pd.DataFrame(rows, dtype=object)
+    quantities = pd.json_normalize([x or {} for x in df["items"]]).reindex(columns=list(catalog.keys))
+    quantities = quantities.fillna(0).astype("int64").set_index(df.index)
+
+    def text(column):
+        return df[column].astype("string") if column in df else pd.Series(pd.NA, index=df.index, dtype="string")
+
+    frames = []
+    for product in catalog.products:
+        part = pd.DataFrame({
+            "order_id": df["id"],
+            "product": product.key,
+            "size": text(f"{product.key}_size"),
+            "type": text(f"{product.key}_type"),
+            "waist": text(f"{product.key}_waist"),
+            "quantity": quantities[product.key],
+        })
+        frames.append(part[part["quantity"] > 0])
+    return pd.concat(frames, ignore_index=True)
+
+
+class ProductionSummary:
+    def __init__(self, client, catalog, statuses=SUMMARY_STATUSES, min_refresh=30.0):
+        self._client = client
+        self.catalog = catalog
+        self.statuses = tuple(statuses)
+        self.min_refresh = min_refresh
+        self._lock = threading.Lock()
+        # None: 未確認 / True: DB関数で集計 / False: pandas で集計
+        self._use_rpc = None
+        self._result = None
+        self._parts = None
+        self._watermark = None
+        # 読み直しの範囲にある行 {受付番号: updated_at}（差分の読み込みで毎回返ってくるので、変わっていなければ除く）
+        self._seen = {}
+        self._refreshed_at = 0.0
+
+    def _changed_rows(self, columns):
+        # 採寸値を保存すると orders の version も上がるので、orders.updated_at だけで変更が分かる
+        since = since_watermark(self._watermark) if self._watermark else None
+
+        def query():
+            q = select_orders(self._client, columns)
+            return q.gte("updated_at", since) if since else q.in_("status", list(self.statuses))
+        for rows in iter_chunks(query):
+            for row in rows:
+                if self._seen.get(row["id"]) != row.get("updated_at"):
+                    yield row
+
+    def _advance(self, rows):
+        for row in rows:
+            if row.get("updated_at") and (self._watermark is None or row["updated_at"] > self._watermark):
+                self._watermark = row["updated_at"]
+        self._seen.update((row["id"], row.get("updated_at")) for row in rows if row.get("updated_at"))
+        if self._watermark:
+            cutoff = datetime.fromisoformat(since_watermark(self._watermark))
+            self._seen = {
+                order_id: at for order_id, at in self._seen.items() if datetime.fromisoformat(at) >= cutoff
+            }
+
+    def _refresh_rpc(self):
+        if self._result is not None:
+            changed = list(self._changed_rows(("id", "updated_at")))
+            self._advance(changed)
+            if not changed:
+                return
+        else:
+            # 初回は透かしと、次回に読み直す範囲の行だけを取得しておく
+            res = (
+                self._client.table("orders").select("id", "updated_at")
+                .order("updated_at", desc=True).limit(1).execute()
+            )
+            self._advance(res.data or [])
+            if self._watermark:
+                self._advance(list(self._changed_rows(("id", "updated_at"))))
+        res = self._client.rpc("production_summary", {"p_statuses": list(self.statuses)}).execute()
+        self._result = pd.DataFrame(res.data or [], columns=GROUP_COLUMNS + ["quantity"])
+
+    def _refresh_local(self):
+        columns = ("id", "status", "items", "updated_at") + measurement_columns(self.catalog)
+        changed = list(self._changed_rows(columns))
+        self._advance(changed)
+        if self._parts is not None and not changed:
+            return
+        changed_ids = {row["id"] for row in changed}
+        counted = [row for row in changed if row.get("status") in self.statuses]
+        frames = []
+        if self._parts is not None:
+            frames.append(self._parts[~self._parts["order_id"].isin(changed_ids)])
+        if counted:
+            frames.append(contributions(counted, self.catalog))
+        self._parts = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=["order_id"] + GROUP_COLUMNS + ["quantity"]
+        )
+        self._result = self._parts.groupby(GROUP_COLUMNS, dropna=False, as_index=False)["quantity"].sum()
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < self.min_refresh:
+                return
+            if self._use_rpc is not False:
+                try:
+                    self._refresh_rpc()
+                    self._use_rpc = True
+                except APIError:
+                    if self._use_rpc:
+                        raise
+                    # DB関数が無い環境では pandas で集計する
+                    self._use_rpc = False
+                    self._watermark = None
+                    self._seen = {}
+            if self._use_rpc is False:
+                self._refresh_local()
+            self._refreshed_at = time.monotonic()
+
+    def table(self):
+        """表示用の集計表（商品名は採寸シートの表示名）"""
+        self.refresh()
+        with self._lock:
+            df = self._result.copy()
+        # 商品マスタの並び順で表示する
+        order = {key: i for i, key in enumerate(self.catalog.keys)}
+        df = df.sort_values(
+            GROUP_COLUMNS, key=lambda col: col.map(order) if col.name == "product" else col,
+            ignore_index=True,
+        )
+        labels = {key: product.sheet_label for key, product in self.catalog.by_key.items()}
+        df["product"] = df["product"].map(lambda key: labels.get(key, key))
+        return df.rename(columns={
+            "product": "商品", "size": "サイズ", "type": "タイプ", "waist": "ウエスト", "quantity": "数量",
+        })
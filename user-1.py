@@ -1,14 +1,39 @@
 import streamlit as st
-from supabase import create_client, Client
-import time
+import metrics
+from db import get_client, get_order_cache, get_write_queue
+from events import EventScope, default_event
+from orders_repo import get_order, get_statuses
+from status_watcher import StatusWatcher
+from write_queue import new_key
 
 # --- 初期設定 ---
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+metrics.start_rerun("user")
+# ログイン画面が無いので、既定のイベントの注文を読み書きする
+event = default_event()
+# クライアントはサーバープロセス内で共有され、再実行のたびには作り直さない
+supabase = EventScope(get_client("anon"), event.id)
+order_cache = get_order_cache(event.id)
+# 登録・更新はローカルのジャーナルに記録し、バックグラウンドで Supabase に送る
+writes = get_write_queue("anon", event.id)
+
+# 最終確認画面で表示する列
+MEASURED_COLUMNS = ("id", "name", "status", "items", "pants_waist", "pants_length")
+
+@st.cache_resource
+def get_status_watcher(event_id):
+    # サーバープロセスでイベントごとに1つだけ作り、そのイベントの全セッションで共有する
+    client = EventScope(get_client("anon"), event_id)
+    return StatusWatcher(lambda order_ids: get_statuses(client, order_ids))
+
+watcher = get_status_watcher(event.id)
 
 if "user_order_id" not in st.session_state:
     st.session_state.user_order_id = None
+metrics.set_phase("input" if st.session_state.user_order_id is None else "status")
+
+sync = writes.stats()
+if sync["pending"]:
+    st.caption(f"⏳ 送信待ちのデータが {sync['pending']} 件あります（通信が回復すると自動で送信されます）")
 
 # ===============================
 # STEP 1: 入力画面
@@ -19,30 +44,49 @@ if st.session_state.user_order_id is None:
         name = st.text_input("お名前")
         # 数量入力（省略）
         if st.form_submit_button("次へ"):
-            res = supabase.table("orders").insert({
+            # 連打しても1件だけ登録されるよう、入力画面ごとのキーを使う
+            key = st.session_state.setdefault("user_order_key", new_key())
+            writes.insert({
                 "name": name, 
                 "status": "waiting"  # 最初は待機状態
-            }).execute()
-            st.session_state.user_order_id = res.data[0]["id"]
-            st.rerun()
+            }, key)
+            result = writes.wait(key)
+            if result["order_id"] is None:
+                st.info("ご注文は端末に保存しました。通信が回復してから、もう一度「次へ」を押してください。")
+            else:
+                st.session_state.user_order_id = result["order_id"]
+                watcher.notify(st.session_state.user_order_id, "waiting")
+                st.rerun()
 
 # --- STEP 2: 待機または最終確認 ---
 else:
-    # DBから最新の注文情報とステータスを取得
-    res = supabase.table("orders").select("*").eq("id", st.session_state.user_order_id).single().execute()
-    order = res.data
-
-    if order:
-        # ステータスがスタッフによって 'measured' (採寸済み) に変更されたかチェック
-        if order.get("status") == "waiting":
-            st.title(f"受付番号: {order['id']}")
-            st.warning("現在、スタッフが採寸データを入力中です。しばらくお待ちください...")
-            
-            # 5秒おきに「ボタンを出していいか」チェックするためにリロード
-            time.sleep(5)
-            st.rerun()
+    order_id = st.session_state.user_order_id
+    # ステータスは共有ウォッチャーがまとめて取得したものを参照する
+    status = watcher.status(order_id)
 
-        elif order.get("status") == "measured":
+    # ステータスがスタッフによって 'measured' (採寸済み) に変更されたかチェック
+    if status == "waiting":
+        st.title(f"受付番号: {order_id}")
+        st.warning("現在、スタッフが採寸データを入力中です。しばらくお待ちください...")
+
+        # この部分だけを定期的に再実行し、ステータスが変わったら画面全体を更新する
+        @st.fragment(run_every=2)
+        @metrics.fragment("wait_for_measurement")
+        def wait_for_measurement():
+            if watcher.status(order_id) != "waiting":
+                st.rerun()
+
+        wait_for_measurement()
+
+    elif status == "measured":
+        # 採寸結果の表示に必要な列だけを、必要な時だけ取得する
+        order = get_order(
+            supabase, order_cache, order_id, columns=MEASURED_COLUMNS,
+            fresh=not st.session_state.get("measured_loaded"),
+        )
+        st.session_state.measured_loaded = True
+
+        if order:
             st.title("最終確認")
             st.success("採寸が完了しました。内容を確認してください。")
 
@@ -53,11 +97,13 @@ else:
             col2.metric("パンツ丈", f"{order.get('pants_length')} cm")
             
             st.write("【最終注文数】")
-            st.write(f"シャツ: {order.get('shirt')} / パンツ: {order.get('pants')} / 靴下: {order.get('socks')}")
+            items = order.get("items") or {}
+            st.write(f"シャツ: {items.get('shirt')} / パンツ: {items.get('pants')} / 靴下: {items.get('socks')}")
 
             if st.button("この内容で注文を確定する"):
                 # 最後にステータスを 'completed' にして完全に終了
-                supabase.table("orders").update({"status": "completed"}).eq("id", order["id"]).execute()
+                writes.update(order["id"], {"status": "completed"})
+                watcher.notify(order["id"], "completed")
                 st.session_state.final_done = True
                 st.rerun()
 
@@ -69,4 +115,4 @@ if st.session_state.get("final_done"):
         st.session_state.clear()
         st.rerun()
 
-
+metrics.finish_rerun()
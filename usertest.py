@@ -1,37 +1,13 @@
 import streamlit as st
-import requests
-from supabase import create_client, Client
+import startup
+import metrics
+import events
 #from streamlit_autorefresh import st_autorefresh
 
 # ===============================
-# --- Supabase設定 ---
+# --- 起動 ---
 # ===============================
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# ===============================
-# --- 固定ユーザー認証 ---
-# ===============================
-FIXED_USER_ID = st.secrets["USER_ID"]
-FIXED_PASSWORD = st.secrets["PASSWORD"]
-
-# ===============================
-# --- 商品マスタ ---
-# ===============================
-products = {
-    "blazer":       {"label": "ブレザー",                "price": 12000},
-    "shirt":        {"label": "シャツ",                  "price": 2000},
-    "pants":        {"label": "ズボン",                  "price": 3000},
-    "vest":         {"label": "ベスト",                  "price": 4000},
-    "sweater":      {"label": "セーター",                "price": 4500},
-    "necktie":      {"label": "ネクタイ",                "price": 1500},
-    "sandals":      {"label": "サンダル",                "price": 1800},
-    "pe_shirt":     {"label": "体操服（半袖）",          "price": 2200},
-    "pe_halfpants": {"label": "体操服（ハーフパンツ）",  "price": 2000},
-    "pe_jacket":    {"label": "体操服（ジャージ上着）",  "price": 5000},
-    "pe_pants":     {"label": "体操服（パンツ）",        "price": 3800},
-}
+metrics.start_rerun("usertest")
 
 st.set_page_config(page_title="注文登録", layout="wide")
 
@@ -63,6 +39,9 @@ if "order_id" not in st.session_state:
     st.session_state.order_id = None
 if "user_logged_in" not in st.session_state:
     st.session_state.user_logged_in = False
+if "event" not in st.session_state:
+    st.session_state.event = None
+metrics.set_phase(st.session_state.phase)
 
 # ===============================
 # --- ログイン画面 ---
@@ -72,22 +51,103 @@ if not st.session_state.user_logged_in:
     user_id_input = st.text_input("ユーザーID")
     password_input = st.text_input("パスワード", type="password")
     if st.button("ログイン"):
-        if user_id_input == FIXED_USER_ID and password_input == FIXED_PASSWORD:
+        # イベント（学校）ごとのログイン情報で認証する。st.secrets の初回の読み込み（ファイル監視の
+        # 準備を含む）は遅いので、ログイン画面の表示には使わず、ボタンを押した時に読む（通常は warm_up で読み込み済み）
+        event = events.authenticate("user", user_id_input, password_input)
+        if event is not None:
+            st.session_state.event = event
             st.session_state.user_logged_in = True
             st.session_state.phase = "input"
             st.success("ログイン成功")
             st.rerun()
         else:
             st.error("ログイン失敗")
+    # ログイン画面は streamlit だけで表示する。supabase などを使うモジュールの読み込みと
+    # クライアントの作成は、画面を描いた後に別スレッドで進めておく（ログイン操作の間に終わる）
+    startup.warm_up("usertest", role="anon")
+    metrics.finish_rerun()
     st.stop()
 
+# ===============================
+# --- Supabase設定（ログイン後） ---
+# ===============================
+# ここから先で使うモジュールはログイン後に読み込む（通常は warm_up で読み込み済み）
+from db import get_catalog, get_client, get_write_queue  # noqa: E402
+from orders_repo import get_statuses  # noqa: E402
+from status_watcher import StatusWatcher  # noqa: E402
+from write_queue import new_key  # noqa: E402
+from zipindex import lookup_address  # noqa: E402
+
+event = st.session_state.event
+# クライアントはサーバープロセス内で共有され、再実行のたびには作り直さない。
+# 読み書きはログインしたイベントの注文だけに絞る
+supabase = events.EventScope(get_client("anon"), event.id)
+# 登録・更新はローカルのジャーナルに記録し、バックグラウンドで Supabase に送る（イベントごと）
+writes = get_write_queue("anon", event.id)
+
+@st.cache_resource
+def get_status_watcher(event_id):
+    # サーバープロセスでイベントごとに1つだけ作り、そのイベントの全セッションで共有する
+    client = events.EventScope(get_client("anon"), event_id)
+    return StatusWatcher(lambda order_ids: get_statuses(client, order_ids))
+
+# ===============================
+# --- 商品マスタ ---
+# ===============================
+# 商品マスタは catalog.py で共通管理（価格ベクトルはプロセス内で組み立て済み）
+catalog = get_catalog(event.id)
+
+sync = writes.stats()
+if sync["pending"]:
+    st.caption(f"⏳ 送信待ちのデータが {sync['pending']} 件あります（通信が回復すると自動で送信されます）")
+
 # ===============================
 # --- 商品入力コンポーネント ---
 # ===============================
+# 数量を変えた時は、その商品の行と合計金額だけを再実行する
+# （CSS やお客様情報、他の商品の行は描き直さない）
+def quantity_changed(key):
+    st.rerun([f"product_{key}", "order_total"])
+
 def product_row(label: str, key: str):
     st.markdown(f"### {label}")
-    qty = st.selectbox("数量を選択してください", options=list(range(11)), key=f"cust_qty_{key}")
-    return {"qty": qty}
+    st.selectbox(
+        "数量を選択してください", options=list(range(11)), key=f"cust_qty_{key}",
+        on_change=quantity_changed, args=(key,),
+    )
+
+def current_quantities():
+    return {key: st.session_state.get(f"cust_qty_{key}", 0) for key in catalog.keys}
+
+@st.fragment(key="order_total")
+@metrics.fragment("order_total")
+def order_total():
+    # --- 合計金額計算 ---
+    total_price = catalog.total(current_quantities())
+    st.markdown(f"<div class='total-box'>合計金額：{total_price:,} 円</div>", unsafe_allow_html=True)
+
+@st.fragment
+@metrics.fragment("customer_info")
+def customer_info():
+    # 入力欄の変更や住所検索では、この部分だけが再実行される
+    st.text_input("お名前（必須）", key="cust_name")
+    zipcode = st.text_input("郵便番号(必須)  ハイフンなしで入力", max_chars=7, placeholder="例: 6068275", key="cust_zipcode")
+
+    if st.button("住所検索"):
+        clean_zip = zipcode.replace("-", "").replace(" ", "")
+        try:
+            # 同梱の郵便番号索引を優先し、見つからない時だけ zipcloud に問い合わせる
+            found = lookup_address(clean_zip)
+            if found:
+                st.session_state.cust_address = found
+            else:
+                st.warning("該当する住所が見つかりませんでした。")
+        except:
+            st.error("住所検索に失敗しました。時間をおいて再度お試しください。")
+
+    st.text_input("住所（必須）", key="cust_address")
+    st.text_input("電話番号（任意）", key="cust_phone")
+    st.text_input("メールアドレス（任意）", key="cust_email")
 # ===============================
 # --- 入力画面 ---
 # ===============================
@@ -98,53 +158,45 @@ if st.session_state.phase == "input":
         st.session_state.clear()
         st.rerun()
 
+    # 確認画面から戻った時は、入力済みの内容を入力欄に戻す
+    for field in ("name", "zipcode", "address", "phone", "email"):
+        st.session_state.setdefault(f"cust_{field}", st.session_state.order_data.get(field) or "")
+    for key, qty in st.session_state.order_data.get("items", {}).items():
+        st.session_state.setdefault(f"cust_qty_{key}", qty)
+
     # --- お客様情報 ---
     st.write("### 1. お客様情報")
-    name = st.text_input("お名前（必須）", value=st.session_state.order_data.get("name", ""))
-    zipcode = st.text_input("郵便番号(必須)  ハイフンなしで入力", value=st.session_state.order_data.get("zipcode",""), max_chars=7, placeholder="例: 6068275")
-
-    if st.button("住所検索"):
-        clean_zip = zipcode.replace("-", "").replace(" ", "")
-        try:
-            res = requests.get(f"https://zipcloud.ibsnet.co.jp/api/search?zipcode={clean_zip}", timeout=6).json()
-            if res.get("results"):
-                r = res["results"][0]
-                st.session_state.address_input = r["address1"] + r["address2"] + r["address3"]
-            else:
-                st.warning("該当する住所が見つかりませんでした。")
-        except:
-            st.error("住所検索に失敗しました。時間をおいて再度お試しください。")
-
-    address = st.text_input("住所（必須）", value=st.session_state.get("address_input", st.session_state.order_data.get("address","")))
-    phone = st.text_input("電話番号（任意）", value=st.session_state.order_data.get("phone",""))
-    email = st.text_input("メールアドレス（任意）", value=st.session_state.order_data.get("email",""))
+    customer_info()
 
     st.divider()
     st.write("### 2. 商品選択")
 
-    # --- 商品ごとにフォーム生成 ---
-    order_data = {}
-    for key, info in products.items():
-        order_data[key] = product_row(info["label"], key)
+    # --- 商品ごとにフォーム生成（行ごとに独立して再実行される） ---
+    for product in catalog.products:
+        row_key = f"product_{product.key}"
+        st.fragment(metrics.fragment(row_key)(product_row), key=row_key)(product.label, product.key)
 
-    # --- 合計金額計算 ---
-    total_price = sum(order_data[k]["qty"] * products[k]["price"] for k in products)
-
-    st.markdown(f"<div class='total-box'>合計金額：{total_price:,} 円</div>", unsafe_allow_html=True)
+    order_total()
 
     if st.button("確認画面へ進む", type="primary", use_container_width=True):
+        quantities = current_quantities()
+        total_price = catalog.total(quantities)
+        name = st.session_state.cust_name
+        address = st.session_state.cust_address
         if not name or not address or total_price == 0:
             st.error("必須項目を入力してください")
         else:
             st.session_state.order_data = {
                 "name": name,
-                "zipcode": zipcode,
+                "zipcode": st.session_state.cust_zipcode,
                 "address": address,
-                "phone": phone,
-                "email": email,
-                "items": {k: order_data[k]["qty"] for k in products},
+                "phone": st.session_state.cust_phone,
+                "email": st.session_state.cust_email,
+                "items": quantities,
                 "total_price": total_price
             }
+            # 「採寸する」の連打や送り直しで注文が二重に登録されないよう、確認画面ごとにキーを振る
+            st.session_state.order_key = new_key()
             st.session_state.phase = "confirm"
             st.rerun()
 
@@ -169,7 +221,7 @@ elif st.session_state.phase == "confirm":
         st.write("【注文商品】")
         for key, qty in data["items"].items():
             if qty > 0:
-                st.write(f"{products[key]['label']}: {qty}点")
+                st.write(f"{catalog.by_key[key].label}: {qty}点")
         st.write(f"合計金額: {data['total_price']:,}円")
 
     st.divider()
@@ -190,17 +242,41 @@ elif st.session_state.phase == "confirm":
                 "status": "waiting",
                 "items": data["items"]  # JSONB保存
             }
-            res = supabase.table("orders").insert(insert_data).execute()
-            if res.data:
-                st.session_state.order_id = res.data[0]["id"]
-                st.session_state.phase = "complete"
-                st.rerun()
+            key = writes.insert(insert_data, st.session_state.order_key)
+            # 通常はすぐに送信されて受付番号が決まる。回線が切れていても記録は残る
+            result = writes.wait(key)
+            st.session_state.order_id = result["order_id"]
+            # 以降の画面は登録した内容をそのまま使い、DBから読み直さない
+            st.session_state.order = insert_data
+            st.session_state.phase = "complete"
+            st.rerun()
+
+# ===============================
+# --- 受付番号の採番待ち（通信が回復するまで） ---
+# ===============================
+elif st.session_state.phase == "complete" and st.session_state.order_id is None:
+    st.title("受付中")
+    st.info("ご注文は端末に保存しました。通信が回復すると受付番号が表示されます。")
+
+    @st.fragment(run_every=2)
+    @metrics.fragment("wait_for_order_id")
+    def wait_for_order_id():
+        result = writes.result(st.session_state.order_key)
+        if result["state"] == "failed":
+            st.error(f"注文を登録できませんでした。スタッフにお声がけください（{result['error']}）")
+        elif result["order_id"] is not None:
+            st.session_state.order_id = result["order_id"]
+            st.rerun()
+
+    wait_for_order_id()
 
 # ===============================
 # --- 採寸待ち画面（数量変更可能） ---
 # ===============================
 elif st.session_state.phase == "complete":
-    order = supabase.table("orders").select("*").eq("id", st.session_state.order_id).single().execute().data
+    # 表示するのは自分で登録・更新した内容だけなので、DBには問い合わせない
+    # （採寸状況だけは共有ウォッチャーが取得する）
+    order = {**st.session_state.order, "id": st.session_state.order_id}
 
     st.title("採寸待ち（数量変更可）")
     st.write(f"受付番号：{order['id']}")
@@ -208,43 +284,48 @@ elif st.session_state.phase == "complete":
     # 数量変更エクスパンダー
     with st.expander("数量を変更する"):
         updated_items = {}
-        total_price = 0
 
-        for key, info in products.items():
-            current_qty = order["items"].get(key, 0)
+        for product in catalog.products:
+            current_qty = order["items"].get(product.key, 0)
             qty = st.selectbox(
-                info["label"],
+                product.label,
                 options=list(range(11)),
                 index=current_qty,
-                key=f"wait_qty_{key}",
+                key=f"wait_qty_{product.key}",
             )
-            updated_items[key] = qty
-            total_price += qty * info["price"]
+            updated_items[product.key] = qty
+        total_price = catalog.total(updated_items)
 
         st.write(f"合計金額：¥{total_price:,}")
 
         if st.button("この内容で数量を更新"):
-            supabase.table("orders").update({
-                "items": updated_items,
-                "total_price": total_price
-            }).eq("id", order["id"]).execute()
+            changes = {"items": updated_items, "total_price": total_price}
+            writes.update(order["id"], changes)
+            st.session_state.order.update(changes)
             st.success("数量を更新しました")
             st.rerun()
 
-    # 最新状態確認ボタン
-    if st.button("最新の状態を確認"):
-        order = supabase.table("orders").select("*").eq("id", st.session_state.order_id).single().execute().data
-        if order["status"] == "measured":
-            st.session_state.measured_done = True
-            st.success("採寸が完了しました！")
-        else:
-            st.info("まだ採寸は完了していません。")
+    # 採寸状況は共有ウォッチャーが一括取得したものを参照する（ボタン操作は不要）
+    watcher = get_status_watcher(event.id)
+    if watcher.status(order["id"]) == "measured":
+        st.session_state.measured_done = True
+    else:
+        st.info("スタッフが採寸中です。完了すると自動で表示が切り替わります。")
+
+        @st.fragment(run_every=2)
+        @metrics.fragment("wait_for_measurement")
+        def wait_for_measurement():
+            if watcher.status(order["id"]) == "measured":
+                st.rerun()
+
+        wait_for_measurement()
 
     # 採寸完了していれば「最終確認へ進む」ボタンを表示（complete フェーズ内だけ）
     if st.session_state.get("measured_done", False):
         if st.button("ご注文内容へ（これ以降は数量の変更等はできません）"):
             st.session_state.phase = "done"
-            supabase.table("orders").update({"status": "completed"}).eq("id", order["id"]).execute()
+            writes.update(order["id"], {"status": "completed"})
+            watcher.notify(order["id"], "completed")
             st.session_state.measured_done = False  # リセット
             st.rerun()
 
@@ -252,7 +333,7 @@ elif st.session_state.phase == "complete":
 # --- 完了画面 ---
 # ===============================
 elif st.session_state.phase == "done":
-    order = supabase.table("orders").select("*").eq("id", st.session_state.order_id).single().execute().data
+    order = st.session_state.order
     st.title("ありがとうございました")
     st.success("注文が確定しました")
     st.write(f"受付番号：{st.session_state.order_id}")
@@ -273,7 +354,7 @@ elif st.session_state.phase == "done":
         items = order.get("items", {})
         for key, qty in items.items():
             if qty > 0:
-                st.write(f"{products[key]['label']}: {qty}点")
+                st.write(f"{catalog.by_key[key].label}: {qty}点")
         st.write(f"合計金額: {order.get('total_price',0):,}円")
 
     st.divider()
@@ -281,3 +362,5 @@ elif st.session_state.phase == "done":
     if st.button("ログアウト"):
         st.session_state.clear()
         st.rerun()
+
+metrics.finish_rerun()
@@ -0,0 +1,297 @@
+"""注文の書き込みキュー（ローカルの SQLite ジャーナル → Supabase）
+
+登録・更新はまずローカルの SQLite に記録して即座に画面へ戻り、バックグラウンドの
+スレッドがまとめて Supabase に送る。会場の回線が切れても記録は残り、回復後に
+送り直される。
+
+    - 冪等キー: 書き込みごとに key を付ける。同じ key の二重登録（ボタンの連打）は
+      ジャーナルでも DB の orders.client_key（一意制約）でも1件になる。
+      更新は orders.write_key に key を残し、応答を受け取れずに送り直した時に
+      自分の更新が反映済みかどうかを判定する（sql/007_orders_write_keys.sql）。
+    - 順序: 同じ受付番号への更新は記録した順に送る。途中で送れなかった更新が
+      あれば、その受付番号の後続の更新はそのパスでは送らない。受付番号の違う
+      更新の列と登録のまとめ送りは互いに待たずに同時に送る。
+    - 再試行: 通信エラーは指数バックオフで何度でも送り直す。DB が拒否した
+      書き込み（制約違反など）は MAX_ATTEMPTS 回で失敗として残す。まとめ送りの
+      登録が拒否されたら1件ずつ送り直し、拒否された登録だけを失敗にする。
+      想定外の例外でも送信スレッドは止めず、バックオフして送り直す。
+    - 採寸列（"pants_waist" など）を含む更新は、orders の更新が反映された後に
+      order_measurements へ upsert する（measurements.py）。
+    - version による排他制御付きの更新が他のスタッフの保存と競合した場合は
+      conflict として残し、画面側で result() から確認する。
+
+同じジャーナルを複数プロセスで開いてもよい（記録はどのプロセスからでもでき、
+送信はファイルロックを取れた1プロセスだけが行う）。
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import httpx
+from postgrest.exceptions import APIError
+
+import metrics
+from async_repo import insert_orders, save_measurements, update_order
+from measurements import split
+
+MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+create table if not exists writes (
+    seq integer primary key autoincrement,
+    key text not null unique,
+    op text not null,
+    order_id integer,
+    payload text not null,
+    expected_version integer,
+    state text not null default 'pending',
+    attempts integer not null default 0,
+    error text,
+    created_at real not null
+);
+create index if not exists writes_state_seq_idx on writes (state, seq);
+"""
+
+
+def new_key():
+    return str(uuid.uuid4())
+
+
+class WriteQueue:
+    def __init__(self, client, path, loop, cache=None, batch_size=50, max_backoff=30.0):
+        # 送信は非同期クライアント（async_repo.py）で、loop（EventLoop）のスレッドから行う
+        self._client = client
+        self._loop = loop
+        # 更新内容をその場で反映する注文キャッシュ（order_cache.OrderCache）
+        self._cache = cache
+        self.path = path
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=full")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._wakeup = threading.Event()
+        self._lock_file = open(path + ".lock", "a")
+        self._thread = None
+
+    # ===============================
+    # --- 記録 ---
+    # ===============================
+    def _append(self, key, op, payload, order_id=None, expected_version=None):
+        with self._lock:
+            self._db.execute(
+                "insert or ignore into writes (key, op, order_id, payload, expected_version, created_at)"
+                " values (?, ?, ?, ?, ?, ?)",
+                (key, op, order_id, json.dumps(payload, ensure_ascii=False), expected_version, time.time()),
+            )
+        self._wakeup.set()
+        return key
+
+    def insert(self, data, key):
+        """注文の登録を記録する。受付番号は送信後に result(key) / wait(key) で分かる"""
+        return self._append(key, "insert", {**data, "client_key": key})
+
+    def update(self, order_id, fields, key=None, expected_version=None):
+        """更新を記録し、キャッシュにも反映する。expected_version を渡すと
+        DB の version が一致する時だけ更新する"""
+        key = key or new_key()
+        self._append(key, "update", {**fields, "write_key": key}, order_id, expected_version)
+        if self._cache is not None:
+            self._cache.merge(order_id, fields)
+        return key
+
+    # ===============================
+    # --- 状態の確認 ---
+    # ===============================
+    def result(self, key):
+        """{"state": pending/done/conflict/failed, "order_id", "error"}（未記録なら None）"""
+        with self._lock:
+            row = self._db.execute("select state, order_id, error from writes where key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+    def wait(self, key, timeout=3.0):
+        """送信が終わるまで最大 timeout 秒待って result を返す"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                result = self.result(key)
+                remaining = deadline - time.monotonic()
+                if result is None or result["state"] != "pending" or remaining <= 0:
+                    return result
+                self._changed.wait(remaining)
+
+    def overlay(self, row, columns=None):
+        """DB から読んだ行に、まだ送っていない更新を重ねる"""
+        with self._lock:
+            pending = self._db.execute(
+                "select payload from writes where op = 'update' and state = 'pending' and order_id = ?"
+                " order by seq",
+                (row["id"],),
+            ).fetchall()
+        for entry in pending:
+            fields = json.loads(entry["payload"])
+            fields.pop("write_key", None)
+            row.update({k: v for k, v in fields.items() if columns is None or k in columns})
+        return row
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("select state, count(*) from writes group by state").fetchall())
+            oldest = self._db.execute("select min(created_at) from writes where state = 'pending'").fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "conflict": counts.get("conflict", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_age": time.time() - oldest if oldest else 0.0,
+        }
+
+    # ===============================
+    # --- 送信 ---
+    # ===============================
+    def _finish(self, seq, state, order_id=None, error=None):
+        with self._lock:
+            self._db.execute(
+                "update writes set state = ?, order_id = coalesce(?, order_id), error = ? where seq = ?",
+                (state, order_id, error, seq),
+            )
+
+    def _retry_later(self, entry, error, permanent):
+        attempts = entry["attempts"] + 1
+        state = "failed" if permanent and attempts >= MAX_ATTEMPTS else "pending"
+        with self._lock:
+            # 同じパスで送り終えたもの（done など）は戻さない
+            self._db.execute(
+                "update writes set attempts = ?, state = ?, error = ? where seq = ? and state = 'pending'",
+                (attempts, state, str(error), entry["seq"]),
+            )
+
+    async def _send_inserts(self, entries):
+        """登録をまとめて1回の upsert で送る。送り直しが必要なら False"""
+        payloads = [json.loads(entry["payload"]) for entry in entries]
+        try:
+            # 既に登録済みの client_key は無視されるので、送り直しても二重登録にならない
+            ids = await insert_orders(self._client, payloads)
+        except APIError as e:
+            if len(entries) > 1:
+                # どの登録が拒否されたか分からないので1件ずつ送り直し、他のお客様の登録は巻き込まない
+                return all(await asyncio.gather(*(self._send_inserts([entry]) for entry in entries)))
+            self._retry_later(entries[0], e, permanent=True)
+            return False
+        except httpx.HTTPError as e:
+            for entry in entries:
+                self._retry_later(entry, e, permanent=False)
+            return False
+        for entry, payload in zip(entries, payloads):
+            order_id = ids.get(payload["client_key"])
+            self._finish(entry["seq"], "done", order_id=order_id)
+            if self._cache is not None and order_id is not None:
+                self._cache.put({**payload, "id": order_id}, ("id",) + tuple(payload))
+        return True
+
+    async def _send_update(self, entry):
+        fields = json.loads(entry["payload"])
+        if await update_order(self._client, entry["order_id"], fields, entry["expected_version"]) is not None:
+            return "done"
+        res = await self._client.table("orders").select("write_key").eq("id", entry["order_id"]).execute()
+        if not res.data:
+            return "failed"
+        if res.data[0].get("write_key") != entry["key"]:
+            return "conflict"
+        # 前回の送信で orders は反映済み（応答を受け取れなかったか、採寸値の保存前に中断した）
+        await save_measurements(self._client, entry["order_id"], split(fields)[1])
+        return "done"
+
+    async def _send_updates(self, entries):
+        """1つの受付番号への更新を記録順に送る。送れなかったら後続はそのパスでは送らない"""
+        for entry in entries:
+            try:
+                state = await self._send_update(entry)
+            except (APIError, httpx.HTTPError) as e:
+                # 回線断などの通信エラーは何度でも、DB が拒否したものは MAX_ATTEMPTS 回まで送り直す
+                self._retry_later(entry, e, permanent=isinstance(e, APIError))
+                return False
+            self._finish(entry["seq"], state, error=None if state == "done" else "他の端末で更新されています")
+        return True
+
+    async def _send(self, entries):
+        # 登録のまとめ送りと、受付番号ごとの更新の列を同時に送る
+        sends = []
+        inserts = [entry for entry in entries if entry["op"] == "insert"]
+        if inserts:
+            sends.append(self._send_inserts(inserts))
+        updates = {}
+        for entry in entries:
+            if entry["op"] == "update":
+                updates.setdefault(entry["order_id"], []).append(entry)
+        sends += [self._send_updates(chain) for chain in updates.values()]
+        # 想定外の例外が出ても、他の送信が終わるのを待ってから伝える
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return all(results)
+
+    def flush_once(self):
+        """未送信の書き込みを batch_size 件まで送る。送り直しが必要な書き込みが残ったら False"""
+        with self._lock:
+            entries = self._db.execute(
+                "select * from writes where state = 'pending' order by seq limit ?", (self.batch_size,)
+            ).fetchall()
+        if not entries:
+            return True
+        try:
+            return self._loop.run(self._send(entries))
+        except Exception as e:
+            # 想定外の例外（クライアントの不具合など）でも記録は残し、バックオフして送り直す
+            logger.exception("書き込みキューの送信に失敗しました")
+            for entry in entries:
+                self._retry_later(entry, e, permanent=False)
+            return False
+        finally:
+            with self._changed:
+                self._changed.notify_all()
+            metrics.record_queue(self.stats())
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            self._wakeup.wait(timeout=backoff)
+            self._wakeup.clear()
+            try:
+                # 送信は1プロセスだけが行う（他のプロセスは記録だけする）
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            try:
+                while True:
+                    if not self.flush_once():
+                        backoff = min(backoff * 2, self.max_backoff)
+                        break
+                    backoff = 0.5
+                    if not self.stats()["pending"]:
+                        break
+            except Exception:
+                # ジャーナルの読み書きの失敗などでもスレッドは止めず、次の周期で送り直す
+                logger.exception("書き込みキューの送信スレッドでエラーが発生しました")
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,195 @@
+"""郵便番号→住所のオフライン索引
+
+日本郵便の KEN_ALL.CSV から作ったバイナリ索引をメモリマップで開き、
+7桁の郵便番号を二分探索で引く。索引はプロセス内で1回だけ開かれ、
+全セッションで共有される。索引にない番号だけ zipcloud API に問い合わせる。
+
+索引（data/zipcode.idx）はデプロイ時に作っておく（端末からの検索では通信しない）:
+    python zipindex.py                  # 日本郵便から ken_all.zip を取得して作る
+    python zipindex.py KEN_ALL.CSV      # 手元の CSV（または ken_all.zip）から作る
+
+索引が無く data/ken_all.zip がある時は、最初の検索で別スレッドから作る。
+環境変数 ZIPINDEX_DOWNLOAD=1 の時だけ、ken_all.zip も無ければ日本郵便から取得して作る
+（ビルド手順を持てないホスティング向け）。作り終わるまでの検索は zipcloud に問い合わせる。
+
+ファイル形式（リトルエンディアン）:
+    ヘッダ   : MAGIC(8バイト) + 件数(uint32)
+    レコード : 郵便番号(uint32) + 住所の開始位置(uint32) + 住所のバイト長(uint32)
+               を郵便番号の昇順に並べたもの
+    住所     : UTF-8 の住所文字列を連結したもの
+"""
+import csv
+import io
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import zipfile
+from functools import lru_cache
+
+import requests
+
+import metrics
+
+MAGIC = b"ZIPIDX1\0"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<III")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+INDEX_PATH = os.path.join(DATA_DIR, "zipcode.idx")
+# 索引の元データ（日本郵便の郵便番号データ・読み仮名なし、全国一括）
+SOURCE_PATH = os.path.join(DATA_DIR, "ken_all.zip")
+SOURCE_URL = "https://www.post.japanpost.jp/zipcode/dl/kogaki/zip/ken_all.zip"
+# 索引も元データも無い時に、実行中に日本郵便から取得してよいか
+DOWNLOAD = bool(os.environ.get("ZIPINDEX_DOWNLOAD"))
+ZIPCLOUD_URL = "https://zipcloud.ibsnet.co.jp/api/search"
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_index = None
+_building = None
+
+
+# ===============================
+# --- 索引の作成 ---
+# ===============================
+def _town_name(town):
+    # 「以下に掲載がない場合」などは zipcloud と同じく町域なしとして扱う
+    if town.startswith("以下に掲載がない場合") or town.endswith("の次に番地がくる場合"):
+        return ""
+    # 「大通西（１～１９丁目）」のような括弧書きは落とす（複数行に分かれた続きも含む）
+    return town.split("（", 1)[0]
+
+
+def _read_source(path):
+    """KEN_ALL.CSV（Shift_JIS）の行を返す。ken_all.zip ならその中の CSV を読む"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            name = next(n for n in archive.namelist() if n.upper().endswith(".CSV"))
+            with archive.open(name) as raw:
+                yield from csv.reader(io.TextIOWrapper(raw, encoding="cp932", newline=""))
+        return
+    with open(path, encoding="cp932", newline="") as f:
+        yield from csv.reader(f)
+
+
+def build_index(csv_path=SOURCE_PATH, out_path=INDEX_PATH):
+    """KEN_ALL.CSV（または ken_all.zip）から索引ファイルを作成し、登録件数を返す"""
+    addresses = {}
+    for row in _read_source(csv_path):
+        zipcode = int(row[2])
+        # 同じ郵便番号が複数町域にまたがる場合は最初の行を採用する
+        if zipcode not in addresses:
+            addresses[zipcode] = row[6] + row[7] + _town_name(row[8])
+
+    records = bytearray()
+    blob = bytearray()
+    for zipcode in sorted(addresses):
+        encoded = addresses[zipcode].encode("utf-8")
+        records += RECORD.pack(zipcode, len(blob), len(encoded))
+        blob += encoded
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(addresses)))
+        f.write(records)
+        f.write(blob)
+    os.replace(tmp_path, out_path)
+    return len(addresses)
+
+
+# ===============================
+# --- 索引の検索 ---
+# ===============================
+class ZipIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"郵便番号索引の形式が不正です: {path}")
+        self._blob_start = HEADER.size + self.count * RECORD.size
+
+    def get(self, zipcode):
+        target = int(zipcode)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            code, offset, length = RECORD.unpack_from(self._mm, HEADER.size + mid * RECORD.size)
+            if code < target:
+                lo = mid + 1
+            elif code > target:
+                hi = mid
+            else:
+                start = self._blob_start + offset
+                return self._mm[start:start + length].decode("utf-8")
+        return None
+
+
+def download_source(path=SOURCE_PATH):
+    """日本郵便から ken_all.zip を取得する"""
+    res = requests.get(SOURCE_URL, timeout=60)
+    res.raise_for_status()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(res.content)
+    os.replace(tmp_path, path)
+
+
+def _build():
+    try:
+        if not os.path.exists(SOURCE_PATH) and DOWNLOAD:
+            download_source()
+        build_index()
+    except Exception:
+        # 作れなくても検索は zipcloud で続けられる（次にプロセスが起動した時に作り直す）
+        logger.exception("郵便番号索引を作成できませんでした")
+
+
+def get_index():
+    """共有の索引を返す。索引ファイルが無ければ（作れる時は別スレッドで作り始めて）None を返す"""
+    global _index, _building
+    if _index is None:
+        with _lock:
+            if _index is None and os.path.exists(INDEX_PATH):
+                _index = ZipIndex(INDEX_PATH)
+            elif _index is None and _building is None and (DOWNLOAD or os.path.exists(SOURCE_PATH)):
+                _building = threading.Thread(target=_build, name="zipindex-build", daemon=True)
+                _building.start()
+    return _index
+
+
+@lru_cache(maxsize=4096)
+def lookup_address(zipcode):
+    """住所を返す。見つからなければ None、通信エラーは例外のまま返す"""
+    if len(zipcode) != 7 or not zipcode.isdigit():
+        return None
+
+    index = get_index()
+    if index is not None:
+        address = index.get(zipcode)
+        if address is not None:
+            return address
+
+    # 索引に無い番号（新設など）だけ zipcloud に問い合わせる
+    with metrics.timed("http", "zipcloud"):
+        res = requests.get(ZIPCLOUD_URL, params={"zipcode": zipcode}, timeout=6).json()
+    if res.get("results"):
+        r = res["results"][0]
+        return r["address1"] + r["address2"] + r["address3"]
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        print("使い方: python zipindex.py [KEN_ALL.CSV または ken_all.zip] [出力先]")
+        sys.exit(1)
+    if len(sys.argv) == 1 and not os.path.exists(SOURCE_PATH):
+        download_source()
+    count = build_index(*sys.argv[1:])
+    print(f"{count} 件の郵便番号を登録しました")